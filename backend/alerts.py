@@ -27,6 +27,27 @@ def _blocking_play_audio_alert():
 
 # ---------------------------------------------
 
+async def _dispatch_alert(alert_message: str):
+    """Writes the alert to alerts.log and plays the audio alert, both off the event loop."""
+    try:
+        await asyncio.get_event_loop().run_in_executor(None, _blocking_write_alert_to_file, alert_message)
+    except Exception as e:
+        print(f"Error scheduling file alert: {e}")
+    try:
+        await asyncio.get_event_loop().run_in_executor(None, _blocking_play_audio_alert)
+    except Exception as e:
+        print(f"Error scheduling audio alert: {e}")
+
+async def send_incident_alert(incident: Dict):
+    """Alert for a site-wide deauth flood (one per incident, not per forged MAC)."""
+    sources = ", ".join(f"{s['key']}x{s['count']}" for s in incident.get("top_sources", [])[:3]) or "n/a"
+    alert_message = (
+        f"{time.ctime()}: Deauth flood - Rate={incident['peak_rate']}, "
+        f"DistinctSources~{incident.get('distinct_sources', 0)}, Spoofed={incident.get('spoofed_sources', False)}, "
+        f"TopSources={sources}\n"
+    )
+    await _dispatch_alert(alert_message)
+
 async def send_alert(mac: str, device: Dict):
     # Check cooldown
     current_time = time.time()
@@ -42,17 +63,8 @@ async def send_alert(mac: str, device: Dict):
         f"Deauths={device['deauth_count']}, Vendor={device['vendor']}\n"
     )
 
-    # File-based alert (run in executor to avoid blocking main loop)
-    try:
-        await asyncio.get_event_loop().run_in_executor(None, _blocking_write_alert_to_file, alert_message)
-    except Exception as e:
-        print(f"Error scheduling file alert: {e}")
-    
-    # Audio alert (run in executor to avoid blocking main loop)
-    try:
-        await asyncio.get_event_loop().run_in_executor(None, _blocking_play_audio_alert)
-    except Exception as e:
-        print(f"Error scheduling audio alert: {e}")
+    # File-based and audio alert (run in executor to avoid blocking main loop)
+    await _dispatch_alert(alert_message)
     
     # Optional Telegram alert (uncomment and configure if needed)
     """
@@ -9,17 +9,31 @@ from typing import Dict, Set, List
 # Max history length for pattern analysis
 MAX_SSID_HISTORY = 20
 
+# Keep per-device lists from growing indefinitely (e.g., last 500 points)
+MAX_DATA_POINTS = 500
+
+# Device "timestamps" are wall-clock ms (receive time). Anything below this (2001) is an ESP
+# uptime value from rows written before that, which can't be mixed with wall-clock values.
+WALL_CLOCK_MS_MIN = 1_000_000_000_000
+
+# Vendor cache keyed by OUI prefix; persisted in the warm-start snapshot
+_vendor_cache: Dict[str, str] = {}
+
 async def oui_lookup(mac: str) -> str:
     # Assuming oui.db is in the same directory as sigvoid.db or accessible
     OUI_DB_PATH = "backend/database/oui.db" # Make sure to put your oui.db here
+    oui = mac[:8].replace(":", "").upper()
+    if oui in _vendor_cache:
+        return _vendor_cache[oui]
     try:
         async with aiosqlite.connect(OUI_DB_PATH) as db:
             db.row_factory = aiosqlite.Row # Ensure row_factory for consistency
             cursor = await db.cursor()
-            oui = mac[:8].replace(":", "").upper()
             await cursor.execute("SELECT vendor FROM oui WHERE oui = ?", (oui,))
             result = await cursor.fetchone()
-            return result['vendor'] if result else "Unknown"
+            vendor = result['vendor'] if result else "Unknown"
+            _vendor_cache[oui] = vendor # Only cache answers the DB actually gave
+            return vendor
     except aiosqlite.Error as e:
         print(f"OUI lookup DB error: {e}")
         return "Unknown"
@@ -27,12 +41,85 @@ async def oui_lookup(mac: str) -> str:
         print(f"Unexpected error in OUI lookup: {e}")
         return "Unknown"
 
+def _load_field(device: Dict, key: str, default):
+    """Device fields are JSON strings in DB rows but live sets/lists/deques in the ingest cache."""
+    value = device.get(key, default)
+    if isinstance(value, str):
+        return json.loads(value)
+    return value
+
+def new_device(vendor: str) -> Dict:
+    """Empty aggregate state for a MAC seen for the first time."""
+    return {
+        "vendor": vendor,
+        "ssid_list": set(),
+        "rssi_list": [],
+        "timestamps": [],
+        "deauth_count": 0,
+        "channel_counts": {},
+        "ssid_history": deque(maxlen=MAX_SSID_HISTORY),
+        "anomaly_score": 0.0,
+        "persistence_score": 0.0,
+        "pattern_score": 0.0,
+    }
+
+def apply_packet(device: Dict, packet: Dict):
+    """
+    Folds one probe/deauth record into a device's running aggregates (in place).
+    Shared by live ingest and archive replay so both build identical state.
+    """
+    packet_type = packet.get("type")
+    # Wall-clock time the record was received ("t", stamped by the ingest loop, the archive and pcap import).
+    # The ESP's own "timestamp" is ms since sensor boot: only used for spans between merged copies.
+    received = packet.get("t") or time.time()
+    device["last_seen"] = received
+    if packet_type == "probe":
+        ssid = packet.get("ssid")
+        rssi = packet.get("rssi")
+        channel = packet.get("channel")
+        timestamp_ms = packet.get("timestamp")
+
+        count = packet.get("count", 1) # >1 for probes merged by the ingest coalescer
+
+        new_rssi, new_timestamps = [], []
+        if ssid:
+            device["ssid_list"].add(ssid)
+            device["ssid_history"].append(ssid) # Add to history
+        if rssi is not None:
+            if count > 1 and packet.get("rssi_min") is not None:
+                # Keep the spread of the merged copies for the variance score, not every copy
+                new_rssi = [packet["rssi_min"], packet["rssi_max"], rssi]
+            else:
+                new_rssi = [rssi]
+        if timestamp_ms:
+            received_ms = int(received * 1000)
+            first_ms = packet.get("first_timestamp")
+            if count > 1 and first_ms:
+                # Spread the merged copies over their time span (from the ESP's clock), ending at the
+                # receive time, so probe frequency still sees all of them
+                span_ms = max(0, timestamp_ms - first_ms)
+                step = span_ms / (count - 1)
+                n = min(count, MAX_DATA_POINTS)
+                new_timestamps = [int(received_ms - span_ms + step * i) for i in range(count - n, count)]
+            else:
+                new_timestamps = [received_ms]
+            if device["timestamps"] and device["timestamps"][-1] < WALL_CLOCK_MS_MIN:
+                device["timestamps"] = [] # Legacy uptime-based history: start over on the wall clock
+        if channel:
+            device["channel_counts"][str(channel)] = device["channel_counts"].get(str(channel), 0) + count
+
+        # Replaced, never appended to in place: snapshot.py shares these lists with its copy of the state
+        device["rssi_list"] = (device["rssi_list"] + new_rssi)[-MAX_DATA_POINTS:]
+        device["timestamps"] = (device["timestamps"] + new_timestamps)[-MAX_DATA_POINTS:]
+    elif packet_type == "deauth":
+        device["deauth_count"] = device.get("deauth_count", 0) + 1
+
 def calculate_anomaly_score(device: Dict, total_devices: int) -> float:
     # Safely load JSON fields, providing defaults for calculation
-    ssid_list = json.loads(device.get("ssid_list", "[]"))
-    timestamps = json.loads(device.get("timestamps", "[]"))
-    rssi_list = json.loads(device.get("rssi_list", "[]"))
-    channel_counts = json.loads(device.get("channel_counts", "{}"))
+    ssid_list = _load_field(device, "ssid_list", [])
+    timestamps = _load_field(device, "timestamps", [])
+    rssi_list = _load_field(device, "rssi_list", [])
+    channel_counts = _load_field(device, "channel_counts", {})
     deauth_count = device.get("deauth_count", 0)
     
     score = 0.0
@@ -72,7 +159,7 @@ def calculate_anomaly_score(device: Dict, total_devices: int) -> float:
     return min(1.0, score) # Cap score at 1.0
 
 def calculate_persistence_score(device: Dict) -> float:
-    timestamps = json.loads(device.get("timestamps", "[]"))
+    timestamps = _load_field(device, "timestamps", [])
     if len(timestamps) < 2:
         return 0.0
     
@@ -90,7 +177,7 @@ def calculate_persistence_score(device: Dict) -> float:
 
 def calculate_pattern_score(device: Dict) -> float:
     # ssid_history is stored as a list in DB, representing the deque
-    ssid_history = json.loads(device.get("ssid_history", "[]"))
+    ssid_history = _load_field(device, "ssid_history", [])
     if len(ssid_history) < 2:
         return 0.0
     
@@ -0,0 +1,337 @@
+# backend/archive.py
+import asyncio
+import hashlib
+import json
+import mmap
+import os
+import struct
+import threading
+import time
+import zlib
+from typing import Dict, Generator, List, Optional
+
+from backend import config
+from backend import analyzer
+from backend import cardinality
+from backend import exporter
+from backend import query
+from backend import state
+from backend import subscriptions
+from backend.database.database import get_db_connection
+
+# Raw capture archive: every record received from the sensor, stored in rotating
+# append-only segment files. Records are batched into zlib-compressed blocks so
+# each flush is one sequential write instead of one SQLite row per packet.
+#
+# For a segment started at <ms> there are up to three files:
+#   <ms>.seg    blocks: [block header][compressed newline-delimited JSON records]
+#   <ms>.idx    sparse time index, one fixed-size entry per block (first_ts, last_ts, offset, length)
+#   <ms>.bloom  MAC Bloom filter, written when the segment is rotated out
+ARCHIVE_DIR = config.get("ARCHIVE_DIR", "backend/database/archive")
+SEGMENT_MAX_BYTES = config.get_int("ARCHIVE_SEGMENT_MB", 32) * 1024 * 1024
+SEGMENT_MAX_SECONDS = config.get_int("ARCHIVE_SEGMENT_SECONDS", 3600)
+BLOCK_MAX_RECORDS = config.get_int("ARCHIVE_BLOCK_RECORDS", 2000)
+BLOCK_MAX_SECONDS = config.get_float("ARCHIVE_BLOCK_SECONDS", 5.0)
+
+_BLOCK_HEADER = struct.Struct("<4sddII") # magic, first_ts, last_ts, record_count, compressed_len
+_BLOCK_MAGIC = b"SVBK"
+_INDEX_ENTRY = struct.Struct("<ddQI")    # first_ts, last_ts, block offset, block length (incl. header)
+_BLOOM_HEADER = struct.Struct("<4sII")   # magic, bit count, hash count
+_BLOOM_MAGIC = b"SVBF"
+BLOOM_BITS = 1 << 19 # 64 KiB per segment; ~1% false positives around 50k distinct MACs
+BLOOM_HASHES = 4
+
+
+class MacBloomFilter:
+    """Fixed-size Bloom filter over MAC addresses (double hashing on a single blake2b digest)."""
+
+    def __init__(self, bits: int = BLOOM_BITS, hashes: int = BLOOM_HASHES, data: Optional[bytes] = None):
+        self.bits = bits
+        self.hashes = hashes
+        self.array = bytearray(data) if data is not None else bytearray(bits // 8)
+
+    def _positions(self, mac: str):
+        digest = hashlib.blake2b(mac.upper().encode("utf-8"), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        for i in range(self.hashes):
+            yield (h1 + i * h2) % self.bits
+
+    def add(self, mac: str):
+        for pos in self._positions(mac):
+            self.array[pos >> 3] |= 1 << (pos & 7)
+
+    def might_contain(self, mac: str) -> bool:
+        return all(self.array[pos >> 3] & (1 << (pos & 7)) for pos in self._positions(mac))
+
+    def to_bytes(self) -> bytes:
+        return _BLOOM_HEADER.pack(_BLOOM_MAGIC, self.bits, self.hashes) + bytes(self.array)
+
+    @classmethod
+    def from_bytes(cls, raw: bytes) -> Optional["MacBloomFilter"]:
+        if len(raw) < _BLOOM_HEADER.size:
+            return None
+        magic, bits, hashes = _BLOOM_HEADER.unpack_from(raw)
+        if magic != _BLOOM_MAGIC or len(raw) - _BLOOM_HEADER.size != bits // 8:
+            return None
+        return cls(bits, hashes, raw[_BLOOM_HEADER.size:])
+
+
+# --- Writer state (event loop side buffers, executor side file handles) ---
+_buffer: List[Dict] = []
+_buffer_started = 0.0
+_write_lock = threading.Lock() # Serializes executor-side writes to the active segment
+
+_segment_name: Optional[str] = None
+_segment_started = 0.0
+_segment_size = 0
+_segment_bloom: Optional[MacBloomFilter] = None
+
+def _paths(name: str):
+    base = os.path.join(ARCHIVE_DIR, name)
+    return base + ".seg", base + ".idx", base + ".bloom"
+
+def _list_segments() -> List[str]:
+    """Segment names (start time in ms) in chronological order."""
+    try:
+        names = [f[:-4] for f in os.listdir(ARCHIVE_DIR) if f.endswith(".seg")]
+    except FileNotFoundError:
+        return []
+    return sorted(names, key=int)
+
+def _blocking_close_segment():
+    """Persists the active segment's Bloom filter; the segment becomes read-only."""
+    global _segment_name, _segment_bloom, _segment_size
+    if _segment_name is None:
+        return
+    _, _, bloom_path = _paths(_segment_name)
+    tmp_path = bloom_path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(_segment_bloom.to_bytes())
+    os.replace(tmp_path, bloom_path)
+    _segment_name = None
+    _segment_bloom = None
+    _segment_size = 0
+
+def _blocking_open_segment(first_ts: float):
+    global _segment_name, _segment_started, _segment_size, _segment_bloom
+    os.makedirs(ARCHIVE_DIR, exist_ok=True)
+    name = str(int(first_ts * 1000))
+    while os.path.exists(_paths(name)[0]): # Never append to a segment from a previous run
+        name = str(int(name) + 1)
+    _segment_name = name
+    _segment_started = time.time()
+    _segment_size = 0
+    _segment_bloom = MacBloomFilter()
+
+def _blocking_write_block(records: List[Dict]):
+    """Compresses one batch of records and appends it (plus its index entry) to the active segment."""
+    global _segment_size
+    if not records:
+        return
+    with _write_lock:
+        if _segment_name is not None and (_segment_size >= SEGMENT_MAX_BYTES or
+                                          time.time() - _segment_started >= SEGMENT_MAX_SECONDS):
+            _blocking_close_segment()
+        if _segment_name is None:
+            _blocking_open_segment(records[0]["t"])
+
+        payload = "\n".join(json.dumps(r, separators=(",", ":")) for r in records).encode("utf-8")
+        compressed = zlib.compress(payload, 6)
+        first_ts = min(r["t"] for r in records)
+        last_ts = max(r["t"] for r in records)
+        header = _BLOCK_HEADER.pack(_BLOCK_MAGIC, first_ts, last_ts, len(records), len(compressed))
+
+        seg_path, idx_path, _ = _paths(_segment_name)
+        with open(seg_path, "ab") as f:
+            offset = f.tell()
+            f.write(header)
+            f.write(compressed)
+        with open(idx_path, "ab") as f:
+            f.write(_INDEX_ENTRY.pack(first_ts, last_ts, offset, len(header) + len(compressed)))
+        _segment_size = offset + len(header) + len(compressed)
+
+        for r in records:
+            if r.get("mac"):
+                _segment_bloom.add(r["mac"])
+
+async def append(record: Dict):
+    """
+    Queues one received record for the archive. The receive time is stored as "t"
+    (seconds); the sensor's own millisecond timestamp stays in the record untouched.
+    """
+    global _buffer, _buffer_started
+    if not _buffer:
+        _buffer_started = time.time()
+    _buffer.append({"t": time.time(), **record})
+    if len(_buffer) >= BLOCK_MAX_RECORDS or time.time() - _buffer_started >= BLOCK_MAX_SECONDS:
+        await flush()
+
+async def flush():
+    """Hands the current buffer to the executor as one compressed block."""
+    global _buffer
+    if not _buffer:
+        return
+    records, _buffer = _buffer, []
+    try:
+        await asyncio.get_event_loop().run_in_executor(None, _blocking_write_block, records)
+    except Exception as e:
+        print(f"Error writing archive block ({len(records)} records dropped): {e}")
+
+async def flush_loop():
+    """Background task so quiet periods still reach disk within BLOCK_MAX_SECONDS."""
+    while True:
+        await asyncio.sleep(BLOCK_MAX_SECONDS)
+        await flush()
+
+async def close():
+    """Flushes pending records and seals the active segment (call on shutdown)."""
+    await flush()
+    def _close():
+        with _write_lock:
+            _blocking_close_segment()
+    await asyncio.get_event_loop().run_in_executor(None, _close)
+
+
+# --- Readers (blocking; run in an executor or a streaming response thread) ---
+
+def _read_index(idx_path: str) -> List[tuple]:
+    try:
+        with open(idx_path, "rb") as f:
+            raw = f.read()
+    except FileNotFoundError:
+        return []
+    usable = len(raw) - len(raw) % _INDEX_ENTRY.size # Ignore a torn trailing entry
+    return [_INDEX_ENTRY.unpack_from(raw, off) for off in range(0, usable, _INDEX_ENTRY.size)]
+
+def _segment_might_contain(name: str, mac: str) -> bool:
+    if name == _segment_name and _segment_bloom is not None:
+        return _segment_bloom.might_contain(mac)
+    _, _, bloom_path = _paths(name)
+    try:
+        with open(bloom_path, "rb") as f:
+            bloom = MacBloomFilter.from_bytes(f.read())
+    except FileNotFoundError:
+        return True # Segment from a run that didn't shut down cleanly; have to scan it
+    return bloom.might_contain(mac) if bloom else True
+
+def iter_segment_records(name: str, start: float, end: float, mac: Optional[str] = None) -> Generator[Dict, None, None]:
+    """Yields records of one segment in [start, end], reading only blocks the index says overlap."""
+    seg_path, idx_path, _ = _paths(name)
+    entries = [e for e in _read_index(idx_path) if e[1] >= start and e[0] <= end]
+    if not entries:
+        return
+    mac = mac.upper() if mac else None
+    with open(seg_path, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            for _, _, offset, length in entries:
+                if offset + length > len(mm):
+                    break # Index is ahead of the mapping (block still being written)
+                magic, _, _, _, clen = _BLOCK_HEADER.unpack_from(mm, offset)
+                if magic != _BLOCK_MAGIC:
+                    print(f"Corrupt archive block in {seg_path} at offset {offset}, skipping")
+                    continue
+                body_start = offset + _BLOCK_HEADER.size
+                for line in zlib.decompress(mm[body_start:body_start + clen]).split(b"\n"):
+                    record = json.loads(line)
+                    if not (start <= record["t"] <= end):
+                        continue
+                    if mac and str(record.get("mac", "")).upper() != mac:
+                        continue
+                    yield record
+
+def segments_for_range(start: float, end: float, mac: Optional[str] = None) -> List[str]:
+    """Segments that can hold records in [start, end] (and the MAC, per the Bloom filter)."""
+    selected = []
+    names = _list_segments()
+    for i, name in enumerate(names):
+        if int(name) / 1000.0 > end:
+            break # Named by first record time, so every later segment starts after `end` too
+        # Records are appended in time order, so a segment ends where the next one starts
+        # (+1 ms: names are truncated to whole ms). The active (last) segment has no end yet.
+        if i + 1 < len(names) and int(names[i + 1]) / 1000.0 + 0.001 < start:
+            continue
+        if mac and not _segment_might_contain(name, mac):
+            continue
+        selected.append(name)
+    return selected
+
+def iter_records(start: float, end: float, mac: Optional[str] = None) -> Generator[Dict, None, None]:
+    for name in segments_for_range(start, end, mac):
+        yield from iter_segment_records(name, start, end, mac)
+
+def iter_records_ndjson(start: float, end: float, mac: Optional[str] = None) -> Generator[bytes, None, None]:
+    """Newline-delimited JSON stream for StreamingResponse."""
+    for record in iter_records(start, end, mac):
+        yield (json.dumps(record, separators=(",", ":")) + "\n").encode("utf-8")
+
+def get_stats() -> Dict:
+    names = _list_segments()
+    total_bytes = 0
+    for name in names:
+        for path in _paths(name):
+            if os.path.exists(path):
+                total_bytes += os.path.getsize(path)
+    return {
+        "segments": len(names),
+        "bytes_on_disk": total_bytes,
+        "oldest": int(names[0]) / 1000.0 if names else None,
+        "active_segment": _segment_name,
+        "buffered_records": len(_buffer),
+    }
+
+
+# --- Replay ---
+
+def _blocking_rebuild(start: float, end: float, mac: Optional[str], density: int) -> tuple:
+    """
+    Streams the range block by block and folds it into fresh aggregates, then scores them.
+    Runs in a worker thread: only touches its own dicts, never state.devices.
+    """
+    rebuilt: Dict[str, Dict] = {}
+    replayed = 0
+    for record in iter_records(start, end, mac):
+        if record.get("type") not in ("probe", "deauth") or not record.get("mac"):
+            continue
+        device = rebuilt.get(record["mac"])
+        if device is None:
+            device = rebuilt[record["mac"]] = analyzer.new_device("Unknown") # Vendor filled in on the loop
+        analyzer.apply_packet(device, record)
+        replayed += 1
+
+    for device in rebuilt.values():
+        device["anomaly_score"] = analyzer.calculate_anomaly_score(device, density)
+        device["persistence_score"] = analyzer.calculate_persistence_score(device)
+        device["pattern_score"] = analyzer.calculate_pattern_score(device)
+    return rebuilt, replayed
+
+async def replay(start: float, end: float, mac: Optional[str] = None) -> Dict:
+    """
+    Rebuild, not merge: every device with archived records in [start, end] has its aggregates
+    REPLACED by what those records alone produce (SSIDs, channels, deauths and timestamps from
+    outside the range are dropped), in the devices table and the hot cache. Devices without
+    records in the range are left alone. Merging instead would double count, since every live
+    record is also in the archive. To rebuild a device's full history, pass a range covering it.
+    """
+    rebuilt, replayed = await asyncio.get_event_loop().run_in_executor(
+        None, _blocking_rebuild, start, end, mac, cardinality.device_density() # Same density live scoring uses
+    )
+
+    banned_macs = await exporter.get_banned_macs()
+    for device_mac, device in rebuilt.items():
+        device["vendor"] = await analyzer.oui_lookup(device_mac)
+        if device_mac in banned_macs:
+            device["anomaly_score"] = max(device["anomaly_score"], 0.95)
+    if rebuilt:
+        async with await get_db_connection() as db:
+            await exporter.bulk_upsert_devices(db, rebuilt)
+            await db.commit()
+        query.bump("devices")
+    for device_mac, device in rebuilt.items():
+        state.devices[device_mac] = device
+        subscriptions.device_index.update(device_mac, device)
+
+    return {"status": f"Rebuilt {len(rebuilt)} devices from {replayed} archived records.",
+            "start": start, "end": end, "devices": len(rebuilt), "records": replayed}
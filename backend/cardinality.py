@@ -0,0 +1,233 @@
+# backend/cardinality.py
+import asyncio
+import hashlib
+import math
+import time
+from collections import deque
+from typing import Dict, List, Optional, Tuple
+
+from backend import config
+from backend import query
+from backend.database.database import get_db_connection
+
+# Distinct MAC / SSID counts per time window from HyperLogLog sketches.
+# One sketch per (kind, scope) per bucket; buckets line up with the channel occupancy
+# rollups and are persisted next to them in cardinality_sketches.
+HLL_PRECISION = config.get_int("HLL_PRECISION", 10) # 2^10 one-byte registers, ~3.25% standard error
+BUCKET_SECONDS = config.get_int("CHANNEL_BUCKET_SECONDS", 60) # Same buckets as channels.py
+HISTORY_SECONDS = 86400 # Site-wide ("all" scope) buckets kept in memory for the 24h window
+WINDOWS = (300, 3600, 86400)
+DENSITY_WINDOW_SECONDS = 3600 # Device density fed to analyzer's adaptive weights
+KINDS = ("mac", "ssid")
+
+
+class HyperLogLog:
+    """HyperLogLog over a 64-bit blake2b hash. Sketches with equal precision merge by register max."""
+
+    def __init__(self, p: int = HLL_PRECISION, registers: Optional[bytes] = None):
+        self.p = p
+        self.m = 1 << p
+        self.registers = bytearray(registers) if registers is not None else bytearray(self.m)
+
+    def add(self, value: str):
+        x = int.from_bytes(hashlib.blake2b(value.encode("utf-8"), digest_size=8).digest(), "little")
+        index = x & (self.m - 1)
+        rank = (64 - self.p) - (x >> self.p).bit_length() + 1 # Position of the leftmost 1-bit
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+
+    def merge(self, other: "HyperLogLog") -> "HyperLogLog":
+        self.registers = bytearray(map(max, self.registers, other.registers))
+        return self
+
+    def copy(self) -> "HyperLogLog":
+        return HyperLogLog(self.p, self.registers)
+
+    def count(self) -> int:
+        alpha = 0.7213 / (1 + 1.079 / self.m)
+        estimate = alpha * self.m * self.m / sum(_INVERSE_POWERS[r] for r in self.registers)
+        zeros = self.registers.count(0)
+        if estimate <= 2.5 * self.m and zeros:
+            estimate = self.m * math.log(self.m / zeros) # Small-range (linear counting) correction
+        return int(round(estimate))
+
+_INVERSE_POWERS = [2.0 ** -r for r in range(65)]
+
+
+class CardinalityTracker:
+    def __init__(self):
+        self.bucket_start: Optional[float] = None
+        self.current: Dict[Tuple[str, str], HyperLogLog] = {} # (kind, scope) -> sketch for the open bucket
+        self.history = deque(maxlen=HISTORY_SECONDS // BUCKET_SECONDS) # (bucket, {kind: sketch}) for "all"
+        self._closed_windows: Dict[Tuple[str, int], HyperLogLog] = {} # Merged closed buckets, rebuilt per roll
+
+    def _sketch(self, kind: str, scope: str) -> HyperLogLog:
+        sketch = self.current.get((kind, scope))
+        if sketch is None:
+            sketch = self.current[(kind, scope)] = HyperLogLog()
+        return sketch
+
+    def _roll(self, now: float) -> List[tuple]:
+        """Closes the open bucket if its time is up; returns the rows to persist."""
+        bucket = now - now % BUCKET_SECONDS
+        if self.bucket_start is None:
+            self.bucket_start = bucket
+            return []
+        if bucket == self.bucket_start:
+            return []
+        closed, closed_start = self.current, self.bucket_start
+        self.current, self.bucket_start = {}, bucket
+        self.history.append((closed_start, {kind: closed[(kind, "all")] for kind in KINDS if (kind, "all") in closed}))
+        self._closed_windows = {}
+        return [(closed_start, kind, scope, bytes(sketch.registers)) for (kind, scope), sketch in closed.items()]
+
+    def observe(self, packet: Dict, now: float) -> List[tuple]:
+        rows = self._roll(now)
+        scopes = ["all", f"sensor:{packet.get('sensor') or 'esp0'}"]
+        if packet.get("channel"):
+            scopes.append(f"channel:{packet['channel']}")
+        for scope in scopes:
+            if packet.get("mac"):
+                self._sketch("mac", scope).add(packet["mac"])
+            if packet.get("ssid"):
+                self._sketch("ssid", scope).add(packet["ssid"])
+        return rows
+
+    def _closed_window(self, kind: str, window_seconds: int, now: float) -> HyperLogLog:
+        """Union of closed buckets inside the window; cached until the next bucket closes."""
+        key = (kind, window_seconds)
+        merged = self._closed_windows.get(key)
+        if merged is None:
+            merged = HyperLogLog()
+            for bucket, sketches in self.history:
+                if bucket >= now - window_seconds and kind in sketches:
+                    merged.merge(sketches[kind])
+            self._closed_windows[key] = merged
+        return merged
+
+    def count(self, kind: str, window_seconds: int) -> int:
+        """Site-wide distinct count over the last `window_seconds`: one cached union plus the open bucket."""
+        now = time.time()
+        merged = self._closed_window(kind, window_seconds, now).copy()
+        current = self.current.get((kind, "all"))
+        if current is not None:
+            merged.merge(current)
+        return merged.count()
+
+    def load_history(self, rows: List[tuple]):
+        for bucket, kind, registers in rows:
+            if self.history and self.history[-1][0] == bucket:
+                self.history[-1][1][kind] = HyperLogLog(registers=registers)
+            else:
+                self.history.append((bucket, {kind: HyperLogLog(registers=registers)}))
+        self._closed_windows = {}
+
+
+tracker = CardinalityTracker()
+
+async def _write_rows(rows: List[tuple]):
+    """
+    Persists (bucket, kind, scope, registers) rows, merged by register max into any row already
+    stored for that key, e.g. the open bucket flushed at shutdown when the restart lands in it.
+    """
+    if not rows:
+        return
+    async with await get_db_connection() as db:
+        merged = []
+        for bucket, kind, scope, registers in rows:
+            cursor = await db.execute(
+                "SELECT registers FROM cardinality_sketches WHERE bucket = ? AND kind = ? AND scope = ?",
+                (bucket, kind, scope)
+            )
+            row = await cursor.fetchone()
+            if row and len(row["registers"]) == len(registers):
+                registers = bytes(HyperLogLog(registers=registers).merge(HyperLogLog(registers=row["registers"])).registers)
+            merged.append((bucket, kind, scope, registers))
+        await db.executemany(
+            "INSERT OR REPLACE INTO cardinality_sketches (bucket, kind, scope, registers) VALUES (?, ?, ?, ?)", merged
+        )
+        await db.commit()
+    query.bump("cardinality_sketches")
+
+async def record_packet(packet: Dict):
+    if packet.get("type") not in ("probe", "deauth"):
+        return
+    await _write_rows(tracker.observe(packet, time.time()))
+
+async def rollup_loop():
+    """Closes buckets on time even when no packets arrive."""
+    while True:
+        await asyncio.sleep(BUCKET_SECONDS / 4)
+        try:
+            await _write_rows(tracker._roll(time.time()))
+        except Exception as e:
+            print(f"Cardinality rollup error: {e}")
+
+async def flush():
+    """Persists the open bucket's sketches (e.g. on shutdown); merged with the row if the bucket resumes."""
+    if tracker.bucket_start is None:
+        return
+    await _write_rows([(tracker.bucket_start, kind, scope, bytes(sketch.registers))
+                       for (kind, scope), sketch in tracker.current.items()])
+
+async def load_history():
+    """Warms the in-memory 24h window from persisted site-wide sketches."""
+    cutoff = time.time() - HISTORY_SECONDS
+    async with await get_db_connection() as db:
+        cursor = await db.execute(
+            "SELECT bucket, kind, registers FROM cardinality_sketches WHERE scope = 'all' AND bucket >= ? ORDER BY bucket",
+            (cutoff,)
+        )
+        rows = [(row["bucket"], row["kind"], row["registers"]) for row in await cursor.fetchall()]
+    # The open bucket (if the restart landed inside it) is merged back on its next flush
+    tracker.load_history([r for r in rows if r[0] != tracker.bucket_start and len(r[2]) == 1 << HLL_PRECISION])
+
+async def count_scoped(kind: str, scope: str, window_seconds: int) -> int:
+    """Distinct count for any scope; merges persisted buckets plus the open one unless memory covers it."""
+    if scope == "all" and window_seconds <= HISTORY_SECONDS:
+        return tracker.count(kind, window_seconds)
+    merged = HyperLogLog()
+    rows = await query.fetch_all(
+        "SELECT registers FROM cardinality_sketches WHERE kind = ? AND scope = ? AND bucket >= ?",
+        (kind, scope, time.time() - window_seconds)
+    )
+    for row in rows:
+        if len(row["registers"]) == merged.m:
+            merged.merge(HyperLogLog(registers=row["registers"]))
+    current = tracker.current.get((kind, scope))
+    if current is not None:
+        merged.merge(current)
+    return merged.count()
+
+async def bucketed_counts(kind: str, scope_prefix: str, start: float, end: float, bucket_seconds: int) -> Dict[Tuple[float, str], int]:
+    """
+    Distinct counts per (coarse bucket, scope) for scopes starting with `scope_prefix`.
+    Fine buckets are unioned, not summed or maxed, so a device spanning several of them counts once.
+    """
+    merged: Dict[Tuple[float, str], HyperLogLog] = {}
+    def _merge(bucket: float, scope: str, sketch: HyperLogLog):
+        key = (bucket - bucket % bucket_seconds, scope)
+        if key in merged:
+            merged[key].merge(sketch)
+        else:
+            merged[key] = sketch.copy()
+
+    rows = await query.fetch_all(
+        "SELECT bucket, scope, registers FROM cardinality_sketches WHERE kind = ? AND scope LIKE ? AND bucket BETWEEN ? AND ?",
+        (kind, scope_prefix + "%", start, end)
+    )
+    for row in rows:
+        if len(row["registers"]) == 1 << HLL_PRECISION:
+            _merge(row["bucket"], row["scope"], HyperLogLog(registers=row["registers"]))
+    if tracker.bucket_start is not None and start <= tracker.bucket_start <= end:
+        for (k, scope), sketch in tracker.current.items():
+            if k == kind and scope.startswith(scope_prefix):
+                _merge(tracker.bucket_start, scope, sketch)
+    return {key: sketch.count() for key, sketch in merged.items()}
+
+def device_density() -> int:
+    """Distinct MACs over DENSITY_WINDOW_SECONDS, for the analyzer's adaptive weights."""
+    return tracker.count("mac", DENSITY_WINDOW_SECONDS)
+
+def summary() -> Dict:
+    return {kind: {str(window): tracker.count(kind, window) for window in WINDOWS} for kind in KINDS}
@@ -0,0 +1,204 @@
+# backend/channels.py
+import asyncio
+import time
+from typing import Dict, List, Optional
+
+from backend import cardinality
+from backend import config
+from backend import query
+from backend import serial_reader
+from backend.database.database import get_db_connection
+
+# Site-wide channel occupancy, counted incrementally as packets arrive.
+# The open bucket lives in memory; closed buckets are rolled up into channel_occupancy.
+BUCKET_SECONDS = config.get_int("CHANNEL_BUCKET_SECONDS", 60)
+CHANNELS = list(range(1, 14)) # 2.4 GHz channels the ESP8266 can tune to
+
+# Hop plan tuning
+PLAN_HISTORY_SECONDS = config.get_int("CHANNEL_PLAN_HISTORY", 1800)
+PLAN_CYCLE_MS = config.get_int("CHANNEL_PLAN_CYCLE_MS", 3000) # Total dwell for one pass over the plan
+PLAN_MIN_DWELL_MS = 50   # Every channel keeps a sliver of dwell so new activity is still discovered
+PLAN_MAX_CHANNELS = 6
+PLAN_AUTO = config.get_bool("CHANNEL_PLAN_AUTO", False)
+PLAN_INTERVAL_SECONDS = config.get_int("CHANNEL_PLAN_INTERVAL", 120)
+DEAUTH_WEIGHT = 3.0      # A deauth is rarer and more interesting than a probe
+DISTINCT_WEIGHT = 2.0
+
+_bucket_start: Optional[float] = None
+_counts: Dict[int, Dict] = {} # channel -> {"probes": int, "deauths": int, "macs": HyperLogLog}
+_last_plan: Optional[Dict] = None
+
+def _bucket_for(ts: float) -> float:
+    return ts - ts % BUCKET_SECONDS
+
+def _empty_counter() -> Dict:
+    # Distinct MACs via a HyperLogLog (1 KiB) rather than an exact set, so a flood of forged
+    # source addresses can't grow the open bucket without bound
+    return {"probes": 0, "deauths": 0, "macs": cardinality.HyperLogLog()}
+
+def _closed_rows(bucket: float, counts: Dict[int, Dict]) -> List[tuple]:
+    return [(bucket, ch, c["probes"], c["deauths"], c["macs"].count()) for ch, c in counts.items()]
+
+async def _write_rows(rows: List[tuple]):
+    if not rows:
+        return
+    async with await get_db_connection() as db:
+        # A bucket can be written twice (shutdown mid-bucket, then restart): add the counts up
+        await db.executemany("""
+            INSERT INTO channel_occupancy (bucket, channel, probes, deauths, distinct_macs)
+            VALUES (?, ?, ?, ?, ?)
+            ON CONFLICT(bucket, channel) DO UPDATE SET
+                probes = probes + excluded.probes,
+                deauths = deauths + excluded.deauths,
+                distinct_macs = MAX(distinct_macs, excluded.distinct_macs)
+        """, rows)
+        await db.commit()
+    query.bump("channel_occupancy")
+
+async def _roll_if_needed(now: float):
+    """Closes the open bucket once its time is up and persists it."""
+    global _bucket_start, _counts
+    bucket = _bucket_for(now)
+    if _bucket_start is None:
+        _bucket_start = bucket
+    elif bucket != _bucket_start:
+        rows = _closed_rows(_bucket_start, _counts)
+        _bucket_start, _counts = bucket, {}
+        await _write_rows(rows)
+
+async def record_packet(packet: Dict, count_mac: bool = True):
+    """
+    Counts a probe/deauth record (all of its merged copies) against its channel in the current bucket.
+    count_mac=False for flood-suppressed deauths: likely forged sources, kept out of distinct_macs.
+    """
+    channel = packet.get("channel")
+    if not channel or packet.get("type") not in ("probe", "deauth"):
+        return
+    await _roll_if_needed(time.time())
+    counter = _counts.setdefault(int(channel), _empty_counter())
+    count = packet.get("count", 1) # >1 for probes merged by the ingest coalescer
+    if packet["type"] == "probe":
+        counter["probes"] += count
+    else:
+        counter["deauths"] += count
+    if count_mac and packet.get("mac"):
+        counter["macs"].add(packet["mac"])
+
+async def rollup_loop():
+    """Closes buckets on time even when no packets arrive."""
+    while True:
+        await asyncio.sleep(BUCKET_SECONDS / 4)
+        try:
+            await _roll_if_needed(time.time())
+        except Exception as e:
+            print(f"Channel rollup error: {e}")
+
+async def flush():
+    """Persists the open (partial) bucket, e.g. on shutdown."""
+    global _counts
+    if _bucket_start is not None and _counts:
+        rows, _counts = _closed_rows(_bucket_start, _counts), {}
+        await _write_rows(rows)
+
+async def get_occupancy(start: float, end: float) -> List[Dict]:
+    """Per-bucket, per-channel rows in [start, end], including the open in-memory bucket."""
+    rows = await query.fetch_all(
+        "SELECT bucket, channel, probes, deauths, distinct_macs FROM channel_occupancy WHERE bucket BETWEEN ? AND ? ORDER BY bucket",
+        (start, end)
+    )
+    if _bucket_start is not None and start <= _bucket_start <= end:
+        rows.extend({"bucket": b, "channel": ch, "probes": p, "deauths": d, "distinct_macs": m}
+                    for b, ch, p, d, m in _closed_rows(_bucket_start, _counts))
+    return rows
+
+async def get_heatmap(start: float, end: float, bucket_seconds: int = BUCKET_SECONDS) -> Dict:
+    """
+    Channel x time matrices for probes, deauths and distinct MACs. Buckets coarser than
+    BUCKET_SECONDS sum probes/deauths; distinct MACs come from the per-channel HyperLogLog
+    sketches, so a device seen in several merged buckets is counted once.
+    """
+    bucket_seconds = max(BUCKET_SECONDS, bucket_seconds - bucket_seconds % BUCKET_SECONDS)
+    first = start - start % bucket_seconds
+    buckets = []
+    b = first
+    while b <= end:
+        buckets.append(b)
+        b += bucket_seconds
+    position = {bucket: i for i, bucket in enumerate(buckets)}
+    matrices = {name: [[0] * len(buckets) for _ in CHANNELS] for name in ("probes", "deauths", "distinct_macs")}
+
+    for row in await get_occupancy(first, end):
+        if row["channel"] not in CHANNELS:
+            continue
+        col = position.get(row["bucket"] - row["bucket"] % bucket_seconds)
+        if col is None:
+            continue
+        ch = row["channel"] - 1
+        matrices["probes"][ch][col] += row["probes"]
+        matrices["deauths"][ch][col] += row["deauths"]
+        matrices["distinct_macs"][ch][col] = max(matrices["distinct_macs"][ch][col], row["distinct_macs"])
+
+    if bucket_seconds > BUCKET_SECONDS:
+        # The max above is only a lower bound once buckets merge; the sketch union is the real estimate
+        for (bucket, scope), count in (await cardinality.bucketed_counts("mac", "channel:", first, end, bucket_seconds)).items():
+            channel = int(scope.split(":", 1)[1])
+            col = position.get(bucket)
+            if channel in CHANNELS and col is not None:
+                matrices["distinct_macs"][channel - 1][col] = count
+
+    return {"channels": CHANNELS, "bucket_seconds": bucket_seconds, "buckets": buckets, **matrices}
+
+async def compute_hop_plan(history_seconds: int = PLAN_HISTORY_SECONDS) -> Dict:
+    """
+    Splits one hop cycle across channels in proportion to recent activity. The busiest
+    PLAN_MAX_CHANNELS channels share the cycle; every other channel keeps PLAN_MIN_DWELL_MS
+    so the sensor still notices when traffic moves.
+    """
+    now = time.time()
+    weights = {ch: 0.0 for ch in CHANNELS}
+    for row in await get_occupancy(now - history_seconds, now):
+        if row["channel"] in weights:
+            weights[row["channel"]] += (row["probes"] + DEAUTH_WEIGHT * row["deauths"]
+                                        + DISTINCT_WEIGHT * row["distinct_macs"])
+
+    busiest = [ch for ch in sorted(CHANNELS, key=lambda c: weights[c], reverse=True)[:PLAN_MAX_CHANNELS] if weights[ch] > 0]
+    if not busiest:
+        busiest = [1, 6, 11] # No history yet: the usual non-overlapping channels, like the firmware default
+    quiet = [ch for ch in CHANNELS if ch not in busiest]
+
+    budget = PLAN_CYCLE_MS - PLAN_MIN_DWELL_MS * len(quiet)
+    total = sum(weights[ch] for ch in busiest)
+    plan = []
+    for ch in busiest:
+        share = weights[ch] / total if total else 1 / len(busiest)
+        plan.append((ch, max(PLAN_MIN_DWELL_MS, int(budget * share))))
+    plan.extend((ch, PLAN_MIN_DWELL_MS) for ch in quiet)
+    return {"generated_at": now, "history_seconds": history_seconds, "plan": plan, "weights": weights}
+
+def format_plan_command(plan: List[tuple]) -> str:
+    """SET_CHANNEL_PLAN:<ch>:<dwell_ms>,<ch>:<dwell_ms>,... (parsed by handleSerialCommands in rogue_ap.ino)"""
+    return "SET_CHANNEL_PLAN:" + ",".join(f"{ch}:{dwell}" for ch, dwell in plan)
+
+async def push_hop_plan() -> Dict:
+    global _last_plan
+    plan = await compute_hop_plan()
+    sent = await serial_reader.send_command(format_plan_command(plan["plan"]))
+    plan["sent"] = sent
+    if sent:
+        _last_plan = plan
+    return plan
+
+def get_last_plan() -> Optional[Dict]:
+    return _last_plan
+
+async def plan_loop(interval: int = PLAN_INTERVAL_SECONDS):
+    """
+    Re-pushes the hop plan periodically when CHANNEL_PLAN_AUTO is on. The firmware drops
+    a plan that isn't refreshed, so a stopped backend hands hopping back to the sensor.
+    """
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            await push_hop_plan()
+        except Exception as e:
+            print(f"Channel plan push failed: {e}")
@@ -1,35 +1,48 @@
 # backend/cleanup.py
 import time
-from typing import Dict
+from typing import Dict, List
 from backend.database.database import get_db_connection
+from backend import config
+from backend import exporter
+from backend import query
+from backend import state
+from backend import subscriptions
 import json
 
+CLEANUP_SCAN_TIMEOUT_SECONDS = 60 # Full devices scan; longer than the default query timeout
+# Devices idle this long leave the hot cache (same horizon as cleanup_logs' default); their rows stay in the DB
+HOT_DEVICE_MAX_IDLE_SECONDS = config.get_int("HOT_DEVICE_MAX_IDLE_SECONDS", 24 * 3600)
+
+def _inactive_macs(rows: List[Dict], cutoff_timestamp: float) -> List[str]:
+    macs = []
+    for row in rows:
+        timestamps_str = row['timestamps']
+        if timestamps_str:
+            timestamps = json.loads(timestamps_str)
+            if timestamps and (timestamps[-1] / 1000.0 < cutoff_timestamp): # Convert ms to s
+                macs.append(row['mac'])
+    return macs
+
 async def cleanup_logs(max_age_hours: int = 24) -> Dict:
     try:
         cutoff_timestamp = time.time() - max_age_hours * 3600
-        
+
+        # 1. Find inactive devices: a device is "inactive" if its latest timestamp is older than the cutoff.
+        #    We need to deserialize the timestamps JSON string to check the last one, which
+        #    is not easily done directly in SQL without JSON functions.
+        #    The scan runs on the read-only query pool, so it doesn't hold the write lock ingest needs.
+        rows = await query.fetch_all("SELECT mac, timestamps FROM devices", timeout=CLEANUP_SCAN_TIMEOUT_SECONDS)
+        devices_to_delete = await query.run(_inactive_macs, rows, cutoff_timestamp)
+        # The scan saw a snapshot; skip anything ingest has touched since
+        devices_to_delete = [mac for mac in devices_to_delete
+                             if state.devices.get(mac, {}).get("last_seen", 0) < cutoff_timestamp]
+
         async with await get_db_connection() as db:
-            # 1. Clean up individual log entries
+            # 2. Clean up individual log entries
             cursor_logs = await db.execute("DELETE FROM logs WHERE timestamp < ?", (cutoff_timestamp,))
             deleted_logs = cursor_logs.rowcount
 
-            # 2. Clean up inactive devices from the 'devices' table
-            #    A device is "inactive" if its latest timestamp is older than the cutoff.
-            #    We need to deserialize the timestamps JSON string to check the last one.
-            #    This is not easily done directly in SQL without JSON functions.
-            #    A more robust solution would be to add a 'last_seen' REAL column to the devices table.
-            
-            # For now, let's fetch devices and filter in Python, then delete.
-            # This is less efficient for very large tables but safe and correct.
-            devices_to_delete = []
-            cursor_devices = await db.execute("SELECT mac, timestamps FROM devices")
-            async for row in cursor_devices:
-                timestamps_str = row['timestamps']
-                if timestamps_str:
-                    timestamps = json.loads(timestamps_str)
-                    if timestamps and (timestamps[-1] / 1000.0 < cutoff_timestamp): # Convert ms to s
-                        devices_to_delete.append(row['mac'])
-            
+            # 3. Clean up inactive devices from the 'devices' table
             deleted_devices = 0
             if devices_to_delete:
                 placeholders = ','.join('?' for _ in devices_to_delete)
@@ -38,10 +51,40 @@ async def cleanup_logs(max_age_hours: int = 24) -> Dict:
                 deleted_devices = delete_cursor.rowcount
 
             await db.commit()
+        query.bump("logs", "devices")
+        for mac in devices_to_delete:
+            state.devices.pop(mac, None) # Keep the hot cache and dashboard index in step with the table
+            subscriptions.device_index.remove(mac)
         return {"status": f"Deleted {deleted_logs} old log entries and {deleted_devices} inactive devices."}
     except Exception as e:
         return {"error": f"Cleanup failed: {e}"}
 
+async def evict_idle_devices(max_idle_seconds: int = HOT_DEVICE_MAX_IDLE_SECONDS) -> int:
+    """
+    Drops devices not seen for `max_idle_seconds` from state.devices, so one-off (e.g. randomized)
+    MACs don't stay in memory and in every snapshot forever. They are written out first: probes
+    shed under load only updated the cached copy. A later packet reloads them from the DB.
+    """
+    cutoff_timestamp = time.time() - max_idle_seconds
+    idle = {mac: device for mac, device in state.devices.items() if device.get("last_seen", 0) < cutoff_timestamp}
+    if not idle:
+        return 0
+    try:
+        async with await get_db_connection() as db:
+            await exporter.bulk_upsert_devices(db, idle)
+            await db.commit()
+        query.bump("devices")
+    except Exception as e:
+        print(f"Error writing idle devices before eviction: {e}")
+        return 0
+    evicted = 0
+    for mac, device in idle.items():
+        # Skip any device a packet revived while the rows were being written
+        if state.devices.get(mac) is device and device.get("last_seen", 0) < cutoff_timestamp:
+            del state.devices[mac]
+            evicted += 1
+    return evicted
+
 async def prune_blacklist(max_age_days: int = 7) -> Dict:
     try:
         cutoff_timestamp = time.time() - max_age_days * 86400
@@ -49,6 +92,7 @@ async def prune_blacklist(max_age_days: int = 7) -> Dict:
             cursor = await db.execute("DELETE FROM banned_macs WHERE banned_at < ?", (cutoff_timestamp,))
             deleted = cursor.rowcount
             await db.commit()
+        await exporter.refresh_banned_macs()
         return {"status": f"Pruned {deleted} old entries from blacklist."}
     except Exception as e:
         return {"error": f"Blacklist prune failed: {e}"}
\ No newline at end of file
@@ -0,0 +1,58 @@
+# backend/config.py
+import os
+import shlex
+from typing import Dict
+
+# Same file run.sh sources and writes on first launch (shell KEY=VALUE lines)
+CONFIG_FILE = "sigvoid.conf"
+
+def _read_conf_file(path: str = CONFIG_FILE) -> Dict[str, str]:
+    """Parses the shell-style KEY=VALUE config file. Missing file means empty config."""
+    values = {}
+    try:
+        with open(path, "r") as f:
+            for line in f:
+                line = line.strip()
+                if not line or line.startswith("#") or "=" not in line:
+                    continue
+                key, raw_value = line.split("=", 1)
+                try:
+                    parts = shlex.split(raw_value, comments=True)
+                except ValueError:
+                    parts = [raw_value.strip()]
+                values[key.strip()] = parts[0] if parts else ""
+    except FileNotFoundError:
+        pass
+    except Exception as e:
+        print(f"Error reading {path}: {e}")
+    return values
+
+# Read once at import time so every module sees the same configuration
+_file_config = _read_conf_file()
+
+def get(key: str, default: str = None) -> str:
+    """Environment variables override sigvoid.conf (run.sh exports CLI overrides)."""
+    value = os.environ.get(key)
+    if value is None:
+        value = _file_config.get(key)
+    return value if value not in (None, "") else default
+
+def get_int(key: str, default: int) -> int:
+    try:
+        return int(get(key, default))
+    except (TypeError, ValueError):
+        print(f"Invalid integer for {key}, using default {default}")
+        return default
+
+def get_float(key: str, default: float) -> float:
+    try:
+        return float(get(key, default))
+    except (TypeError, ValueError):
+        print(f"Invalid number for {key}, using default {default}")
+        return default
+
+def get_bool(key: str, default: bool = False) -> bool:
+    value = get(key)
+    if value is None:
+        return default
+    return value.strip().lower() in ("1", "true", "yes", "on")
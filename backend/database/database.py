@@ -13,6 +13,9 @@ async def get_db_connection():
 
 async def init_db():
     async with await get_db_connection() as db:
+        # WAL lets the read-only query connections (backend/query.py) read a consistent snapshot
+        # while ingest writes; the mode is stored in the database file, so this sticks
+        await db.execute("PRAGMA journal_mode=WAL;")
         await db.execute("""
             CREATE TABLE IF NOT EXISTS devices (
                 mac TEXT PRIMARY KEY,
@@ -25,9 +28,14 @@ async def init_db():
                 pattern_score REAL,
                 deauth_count INTEGER,
                 channel_counts TEXT, -- JSON string of channel counts (dict)
-                ssid_history TEXT -- JSON string of ordered SSID history (deque)
+                ssid_history TEXT, -- JSON string of ordered SSID history (deque)
+                last_seen REAL -- receive time of the newest record, epoch seconds
             );
         """)
+        # Databases created before last_seen was persisted
+        cursor = await db.execute("PRAGMA table_info(devices);")
+        if "last_seen" not in [row["name"] for row in await cursor.fetchall()]:
+            await db.execute("ALTER TABLE devices ADD COLUMN last_seen REAL;")
         await db.execute("""
             CREATE TABLE IF NOT EXISTS logs (
                 id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -42,6 +50,30 @@ async def init_db():
                 channel INTEGER
             );
         """)
+        # Per-device time range reads (timeline endpoint) walk this index instead of scanning logs
+        await db.execute("CREATE INDEX IF NOT EXISTS idx_logs_mac_timestamp ON logs (mac, timestamp);")
+        # Per-channel occupancy rollups, one row per (time bucket, channel); see backend/channels.py
+        await db.execute("""
+            CREATE TABLE IF NOT EXISTS channel_occupancy (
+                bucket REAL, -- bucket start, epoch seconds
+                channel INTEGER,
+                probes INTEGER,
+                deauths INTEGER,
+                distinct_macs INTEGER,
+                PRIMARY KEY (bucket, channel)
+            );
+        """)
+        # HyperLogLog register arrays per (bucket, kind, scope), rolled up alongside channel_occupancy;
+        # see backend/cardinality.py. scope is "all", "sensor:<id>" or "channel:<n>"
+        await db.execute("""
+            CREATE TABLE IF NOT EXISTS cardinality_sketches (
+                bucket REAL,
+                kind TEXT, -- "mac" or "ssid"
+                scope TEXT,
+                registers BLOB,
+                PRIMARY KEY (bucket, kind, scope)
+            );
+        """)
         await db.execute("""
             CREATE TABLE IF NOT EXISTS banned_macs (
                 mac TEXT PRIMARY KEY,
@@ -0,0 +1,275 @@
+# backend/deauth_monitor.py
+import asyncio
+import hashlib
+import math
+import time
+from collections import deque
+from typing import Dict, List, Optional
+
+from backend import config
+
+# Streaming deauth/disassoc flood detection in fixed memory. Nothing here grows with the
+# number of MACs seen: per-source counts live in a Count-Min Sketch, heavy hitters in
+# Space-Saving tables of K entries, and distinct sources in a fixed-size bitmap.
+WINDOW_SECONDS = config.get_int("DEAUTH_WINDOW_SECONDS", 60)      # Sketch/top-K epoch length
+FLOOD_WINDOW_SECONDS = config.get_int("DEAUTH_FLOOD_WINDOW", 10)  # Rate window for flood detection
+FLOOD_THRESHOLD = config.get_int("DEAUTH_FLOOD_THRESHOLD", 50)    # Deauths per FLOOD_WINDOW_SECONDS
+FLOOD_QUIET_SECONDS = 30 # An incident ends after this long below half the threshold
+SOURCE_ALERT_THRESHOLD = config.get_int("DEAUTH_SOURCE_ALERT_THRESHOLD", 5) # Per-MAC deauths per window
+HEAVY_HITTER_MIN = 3 # During a flood, sources below this estimate are treated as forged one-offs
+TOP_K = 32
+CMS_WIDTH = 2048
+CMS_DEPTH = 4
+DISTINCT_BITS = 8192
+MAX_INCIDENTS = 50
+
+
+def _hashes(key: str, count: int) -> List[int]:
+    digest = hashlib.blake2b(key.encode("utf-8"), digest_size=8 * count).digest()
+    return [int.from_bytes(digest[i * 8:(i + 1) * 8], "little") for i in range(count)]
+
+
+class SlidingWindowCounter:
+    """Event count over the last `window_seconds`, kept in one-second slots."""
+
+    def __init__(self, window_seconds: int):
+        self.slots = [0] * window_seconds
+        self.slot_times = [-1] * window_seconds
+
+    def add(self, now: float, count: int = 1):
+        second = int(now)
+        i = second % len(self.slots)
+        if self.slot_times[i] != second:
+            self.slot_times[i] = second
+            self.slots[i] = 0
+        self.slots[i] += count
+
+    def total(self, now: float) -> int:
+        oldest = int(now) - len(self.slots)
+        return sum(c for c, t in zip(self.slots, self.slot_times) if t > oldest)
+
+
+class CountMinSketch:
+    """Approximate per-key counts; never under-counts, over-counts by at most ~e*N/width."""
+
+    def __init__(self, width: int = CMS_WIDTH, depth: int = CMS_DEPTH):
+        self.width = width
+        self.depth = depth
+        self.rows = [[0] * width for _ in range(depth)]
+
+    def add(self, key: str, count: int = 1):
+        for row, h in zip(self.rows, _hashes(key, self.depth)):
+            row[h % self.width] += count
+
+    def estimate(self, key: str) -> int:
+        return min(row[h % self.width] for row, h in zip(self.rows, _hashes(key, self.depth)))
+
+    def lower_estimate(self, key: str, total: int) -> int:
+        """
+        Estimate minus the expected collision mass per counter (total/width). Under a flood of
+        forged one-off sources every counter fills up, so the raw estimate says nothing about `key`.
+        """
+        return max(0, self.estimate(key) - total // self.width)
+
+
+class SpaceSaving:
+    """Top-K heavy hitters with K counters (Metwally et al.). Counts are upper bounds."""
+
+    def __init__(self, k: int = TOP_K):
+        self.k = k
+        self.counters: Dict[str, List[int]] = {} # key -> [count, overestimation]
+
+    def add(self, key: str, count: int = 1):
+        if key in self.counters:
+            self.counters[key][0] += count
+        elif len(self.counters) < self.k:
+            self.counters[key] = [count, 0]
+        else:
+            victim = min(self.counters, key=lambda k: self.counters[k][0])
+            floor = self.counters.pop(victim)[0]
+            self.counters[key] = [floor + count, floor]
+
+    def guaranteed(self, key: str) -> int:
+        """Count `key` has certainly reached (count minus overestimation); 0 if not tracked."""
+        entry = self.counters.get(key)
+        return entry[0] - entry[1] if entry else 0
+
+    def top(self, n: int = 10) -> List[Dict]:
+        ranked = sorted(self.counters.items(), key=lambda item: item[1][0], reverse=True)[:n]
+        return [{"key": key, "count": count, "error": error} for key, (count, error) in ranked]
+
+
+class DistinctCounter:
+    """Linear-counting cardinality estimate over a fixed bitmap."""
+
+    def __init__(self, bits: int = DISTINCT_BITS):
+        self.bits = bits
+        self.bitmap = bytearray(bits // 8)
+        self.zeros = bits
+
+    def add(self, key: str):
+        pos = _hashes(key, 1)[0] % self.bits
+        mask = 1 << (pos & 7)
+        if not self.bitmap[pos >> 3] & mask:
+            self.bitmap[pos >> 3] |= mask
+            self.zeros -= 1
+
+    def estimate(self) -> int:
+        if self.zeros == 0:
+            return self.bits # Saturated; true count is at least this high
+        return int(round(-self.bits * math.log(self.zeros / self.bits)))
+
+
+class _Epoch:
+    """All per-window structures, replaced wholesale when the window rolls over."""
+
+    def __init__(self, started: float):
+        self.started = started
+        self.sources = CountMinSketch()
+        self.top_sources = SpaceSaving()
+        self.top_targets = SpaceSaving()
+        self.top_channels = SpaceSaving(14)
+        self.distinct_sources = DistinctCounter()
+        self.total = 0
+
+
+class DeauthMonitor:
+    def __init__(self):
+        now = time.time()
+        self.current = _Epoch(now)
+        self.previous: Optional[_Epoch] = None
+        self.rate = SlidingWindowCounter(FLOOD_WINDOW_SECONDS)
+        self.active_incident: Optional[Dict] = None
+        self.incidents = deque(maxlen=MAX_INCIDENTS)
+        self._below_since: Optional[float] = None
+        self.suppressed = 0 # Deauths whose per-MAC persistence was skipped during floods
+
+    def _rotate(self, now: float):
+        if now - self.current.started >= WINDOW_SECONDS:
+            self.previous = self.current
+            self.current = _Epoch(now)
+
+    @staticmethod
+    def _epoch_estimate(epoch: _Epoch, mac: str) -> int:
+        # Error-corrected sketch count, or the Space-Saving guaranteed count if that is higher
+        return max(epoch.sources.lower_estimate(mac, epoch.total), epoch.top_sources.guaranteed(mac))
+
+    def source_estimate(self, mac: str, now: Optional[float] = None) -> int:
+        """
+        Deauths sent by `mac` over roughly the last WINDOW_SECONDS, biased low: a forged one-off
+        source stays near 0 however saturated the sketch is.
+        """
+        now = now or time.time()
+        estimate = self._epoch_estimate(self.current, mac)
+        if self.previous is not None:
+            # Weight the previous epoch by how much of it still overlaps the sliding window
+            overlap = max(0.0, 1.0 - (now - self.current.started) / WINDOW_SECONDS)
+            estimate += int(self._epoch_estimate(self.previous, mac) * overlap)
+        return estimate
+
+    def observe(self, packet: Dict, now: Optional[float] = None) -> Dict:
+        """
+        Accounts one deauth/disassoc record. Returns {"persist": bool, "incident": dict|None},
+        where "incident" is set only when this packet opened a new flood incident.
+        """
+        now = now or time.time()
+        self._rotate(now)
+        mac = packet.get("mac") or "unknown"
+        epoch = self.current
+        epoch.total += 1
+        epoch.sources.add(mac)
+        epoch.top_sources.add(mac)
+        epoch.distinct_sources.add(mac)
+        if packet.get("target"):
+            epoch.top_targets.add(packet["target"])
+        if packet.get("channel"):
+            epoch.top_channels.add(str(packet["channel"]))
+        self.rate.add(now)
+
+        opened = self._update_incident(now)
+        persist = True
+        if self.active_incident is not None and self.source_estimate(mac, now) < HEAVY_HITTER_MIN:
+            persist = False
+            self.suppressed += 1
+            self.active_incident["suppressed"] += 1
+        return {"persist": persist, "incident": opened}
+
+    def _update_incident(self, now: float) -> Optional[Dict]:
+        rate = self.rate.total(now)
+        incident = self.active_incident
+        if incident is None:
+            if rate < FLOOD_THRESHOLD:
+                return None
+            incident = self.active_incident = {
+                "started_at": now,
+                "ended_at": None,
+                "peak_rate": rate,
+                "deauths": 0,
+                "suppressed": 0,
+            }
+            self._below_since = None
+            self.incidents.append(incident)
+            opened = incident
+        else:
+            opened = None
+        incident["deauths"] += 1
+        incident["last_seen"] = now
+        incident["peak_rate"] = max(incident["peak_rate"], rate)
+        self._refresh_summary(incident)
+        return opened
+
+    def _refresh_summary(self, incident: Dict):
+        epoch = self.current
+        distinct = epoch.distinct_sources.estimate()
+        incident.update({
+            "distinct_sources": distinct,
+            # Most sources sending a single frame is the signature of a forged-source flood
+            "spoofed_sources": distinct >= 0.5 * max(epoch.total, 1) and epoch.total >= FLOOD_THRESHOLD,
+            "top_sources": epoch.top_sources.top(5),
+            "top_targets": epoch.top_targets.top(5),
+            "top_channels": epoch.top_channels.top(5),
+        })
+
+    def tick(self, now: Optional[float] = None):
+        """Closes the active incident once the rate has stayed low for FLOOD_QUIET_SECONDS."""
+        now = now or time.time()
+        self._rotate(now)
+        if self.active_incident is None:
+            return
+        if self.rate.total(now) >= FLOOD_THRESHOLD / 2:
+            self._below_since = None
+        elif self._below_since is None:
+            self._below_since = now
+        elif now - self._below_since >= FLOOD_QUIET_SECONDS:
+            self.active_incident["ended_at"] = now
+            self.active_incident = None
+            self._below_since = None
+
+    def get_stats(self) -> Dict:
+        now = time.time()
+        epoch = self.current
+        return {
+            "rate": self.rate.total(now),
+            "rate_window_seconds": FLOOD_WINDOW_SECONDS,
+            "flood_threshold": FLOOD_THRESHOLD,
+            "window_deauths": epoch.total,
+            "distinct_sources": epoch.distinct_sources.estimate(),
+            "top_sources": epoch.top_sources.top(),
+            "top_targets": epoch.top_targets.top(),
+            "top_channels": epoch.top_channels.top(),
+            "suppressed": self.suppressed,
+            "active_incident": self.active_incident,
+        }
+
+    def get_incidents(self) -> List[Dict]:
+        return list(self.incidents)
+
+
+monitor = DeauthMonitor()
+
+
+async def tick_loop():
+    """Lets incidents close while deauth traffic is absent."""
+    while True:
+        await asyncio.sleep(1)
+        monitor.tick()
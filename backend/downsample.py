@@ -0,0 +1,47 @@
+# backend/downsample.py
+from typing import List, Sequence, Tuple
+
+Point = Tuple[float, float]
+
+def lttb(points: Sequence[Point], threshold: int) -> List[Point]:
+    """
+    Largest-Triangle-Three-Buckets downsampling.
+    Keeps the first and last point and, for every bucket in between, the point forming
+    the largest triangle with the previously kept point and the next bucket's average.
+    Peaks and dips survive, which plain striding or averaging would flatten.
+    `points` must be sorted by x.
+    """
+    n = len(points)
+    if threshold >= n or n < 3:
+        return list(points)
+    if threshold < 3:
+        return [points[0], points[-1]]
+
+    sampled = [points[0]]
+    bucket_size = (n - 2) / (threshold - 2)
+    a = 0 # Index of the previously selected point
+
+    for i in range(threshold - 2):
+        # Average of the next bucket (the third triangle vertex)
+        next_start = int((i + 1) * bucket_size) + 1
+        next_end = min(int((i + 2) * bucket_size) + 1, n)
+        next_len = next_end - next_start
+        avg_x = sum(p[0] for p in points[next_start:next_end]) / next_len
+        avg_y = sum(p[1] for p in points[next_start:next_end]) / next_len
+
+        # Pick the point in this bucket with the largest triangle area
+        start = int(i * bucket_size) + 1
+        end = int((i + 1) * bucket_size) + 1
+        ax, ay = points[a]
+        max_area = -1.0
+        max_index = start
+        for j in range(start, end):
+            area = abs((ax - avg_x) * (points[j][1] - ay) - (ax - points[j][0]) * (avg_y - ay))
+            if area > max_area:
+                max_area = area
+                max_index = j
+        sampled.append(points[max_index])
+        a = max_index
+
+    sampled.append(points[-1])
+    return sampled
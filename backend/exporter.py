@@ -2,10 +2,17 @@
 import csv
 import json
 import asyncio
-from typing import Dict, List
+from collections import deque
+from typing import Dict, List, Optional, Set
 import time
 import re
 from backend.database.database import get_db_connection
+from backend import analyzer
+from backend import query
+
+# In-memory ban set so the ingest path doesn't query banned_macs per packet.
+# None means "not loaded yet"; loaded from the banned_macs table (the source of truth) on boot.
+_banned_macs: Set[str] = None
 
 # Helper function to run blocking file I/O in an executor
 def _blocking_file_write(file_path: str, content, mode: str = 'w', is_json: bool = False):
@@ -16,98 +23,160 @@ def _blocking_file_write(file_path: str, content, mode: str = 'w', is_json: bool
         else:
             f.write(content)
 
+def _device_row(mac: str, device_data: Dict) -> tuple:
+    """devices table row for one device; list/dict/set/deque fields are JSON-encoded."""
+    return (
+        mac,
+        device_data.get("vendor"),
+        json.dumps(list(device_data.get("ssid_list", []))), # Convert set to list for JSON
+        json.dumps(device_data.get("rssi_list", [])),
+        json.dumps(device_data.get("timestamps", [])),
+        device_data.get("anomaly_score", 0.0),
+        device_data.get("persistence_score", 0.0),
+        device_data.get("pattern_score", 0.0),
+        device_data.get("deauth_count", 0),
+        json.dumps(device_data.get("channel_counts", {})),
+        json.dumps(list(device_data.get("ssid_history", []))), # Convert deque to list for JSON
+        device_data.get("last_seen")
+    )
+
+_UPSERT_DEVICE_SQL = """
+    INSERT OR REPLACE INTO devices (
+        mac, vendor, ssid_list, rssi_list, timestamps,
+        anomaly_score, persistence_score, pattern_score,
+        deauth_count, channel_counts, ssid_history, last_seen
+    ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+"""
+
+def log_row(mac: str, packet_data: Dict, device_summary: Dict, timestamp: float) -> tuple:
+    return (timestamp,
+            mac,
+            packet_data.get("ssid", ""),
+            packet_data.get("rssi", 0),
+            device_summary.get("anomaly_score", 0.0),
+            device_summary.get("persistence_score", 0.0),
+            device_summary.get("pattern_score", 0.0),
+            device_summary.get("deauth_count", 0),
+            packet_data.get("channel", 0))
+
+_INSERT_LOG_SQL = "INSERT INTO logs (timestamp, mac, ssid, rssi, anomaly_score, persistence_score, pattern_score, deauth_count, channel) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)"
+
 async def upsert_device_state(mac: str, device_data: Dict):
     """
     Updates or inserts a device's state in the 'devices' table.
     Expects device_data to be ready for JSON serialization for list/dict/set fields.
     """
     async with await get_db_connection() as db:
-        await db.execute("""
-            INSERT OR REPLACE INTO devices (
-                mac, vendor, ssid_list, rssi_list, timestamps,
-                anomaly_score, persistence_score, pattern_score,
-                deauth_count, channel_counts, ssid_history
-            ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-        """, (
-            mac,
-            device_data.get("vendor"),
-            json.dumps(list(device_data.get("ssid_list", []))), # Convert set to list for JSON
-            json.dumps(device_data.get("rssi_list", [])),
-            json.dumps(device_data.get("timestamps", [])),
-            device_data.get("anomaly_score", 0.0),
-            device_data.get("persistence_score", 0.0),
-            device_data.get("pattern_score", 0.0),
-            device_data.get("deauth_count", 0),
-            json.dumps(device_data.get("channel_counts", {})),
-            json.dumps(list(device_data.get("ssid_history", []))) # Convert deque to list for JSON
-        ))
+        await db.execute(_UPSERT_DEVICE_SQL, _device_row(mac, device_data))
         await db.commit()
+    query.bump("devices")
 
 async def log_packet_to_db(mac: str, packet_data: Dict, device_summary: Dict):
     """Logs individual packet data to the 'logs' table."""
     async with await get_db_connection() as db:
-        await db.execute(
-            "INSERT INTO logs (timestamp, mac, ssid, rssi, anomaly_score, persistence_score, pattern_score, deauth_count, channel) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
-            (packet_data.get("timestamp", time.time()) / 1000.0, # Timestamps from ESP are in ms
-             mac,
-             packet_data.get("ssid", ""),
-             packet_data.get("rssi", 0),
-             device_summary.get("anomaly_score", 0.0),
-             device_summary.get("persistence_score", 0.0),
-             device_summary.get("pattern_score", 0.0),
-             device_summary.get("deauth_count", 0),
-             packet_data.get("channel", 0))
-        )
+        # Receive time; the ESP's "timestamp" is ms since sensor boot, not wall-clock
+        await db.execute(_INSERT_LOG_SQL, log_row(mac, packet_data, device_summary, time.time()))
         await db.commit()
+    query.bump("logs")
+
+async def load_device_state(db, mac: str) -> Optional[Dict]:
+    """A device's row as live aggregates (sets/lists/deque), or None if it isn't in the DB."""
+    cursor = await db.execute("SELECT * FROM devices WHERE mac = ?", (mac,))
+    row = await cursor.fetchone()
+    if not row:
+        return None
+    device = {k: row[k] for k in row.keys()}
+    # Deserialize JSON fields from DB
+    device['ssid_list'] = set(json.loads(device.get('ssid_list') or '[]')) # Convert to set
+    device['rssi_list'] = json.loads(device.get('rssi_list') or '[]')
+    device['timestamps'] = json.loads(device.get('timestamps') or '[]')
+    device['channel_counts'] = json.loads(device.get('channel_counts') or '{}')
+    device['ssid_history'] = deque(json.loads(device.get('ssid_history') or '[]'), maxlen=analyzer.MAX_SSID_HISTORY) # Re-create deque
+    if not device.get('last_seen') and device['timestamps'] and device['timestamps'][-1] >= analyzer.WALL_CLOCK_MS_MIN:
+        device['last_seen'] = device['timestamps'][-1] / 1000.0 # Row written before last_seen was persisted
+    return device
+
+# Bulk-load variants for offline imports: the caller owns the connection and the transaction
+async def bulk_upsert_devices(db, devices: Dict[str, Dict]):
+    await db.executemany(_UPSERT_DEVICE_SQL, [_device_row(mac, device) for mac, device in devices.items()])
+
+async def bulk_log_packets(db, rows: List[tuple]):
+    """rows come from log_row with the capture time as timestamp."""
+    await db.executemany(_INSERT_LOG_SQL, rows)
+
+async def get_timeline_version(mac: str, start: float, end: float) -> tuple:
+    """
+    (row count, newest row id, first and last timestamp) for a device's logs in a range; covered by
+    idx_logs_mac_timestamp. Identifies the range's contents without depending on the range bounds.
+    """
+    row = await query.fetch_one(
+        "SELECT COUNT(*) AS row_count, MAX(id) AS max_id, MIN(timestamp) AS first_ts, MAX(timestamp) AS last_ts "
+        "FROM logs WHERE mac = ? AND timestamp BETWEEN ? AND ?",
+        (mac, start, end)
+    )
+    return (row["row_count"], row["max_id"] or 0, row["first_ts"], row["last_ts"])
+
+async def get_device_timeline(mac: str, start: float, end: float) -> List[Dict]:
+    """Time-ordered log rows for one device within [start, end] (seconds)."""
+    return await query.fetch_all(
+        "SELECT timestamp, rssi, channel, anomaly_score FROM logs WHERE mac = ? AND timestamp BETWEEN ? AND ? ORDER BY timestamp",
+        (mac, start, end)
+    )
 
 async def get_filtered_devices(min_score: float = 0.0, mac_filter: str = "", ssid_filter: str = "", preset: str = "all") -> Dict:
-    query = "SELECT * FROM devices WHERE 1=1"
+    # Served from the read side; repeated exports with the same filters share one scan
+    return await query.cached(
+        ("filtered_devices", min_score, mac_filter, ssid_filter, preset), ("devices",),
+        lambda: _load_filtered_devices(min_score, mac_filter, ssid_filter, preset)
+    )
+
+async def _load_filtered_devices(min_score: float, mac_filter: str, ssid_filter: str, preset: str) -> Dict:
+    sql = "SELECT * FROM devices WHERE 1=1"
     params = []
 
     # Apply database-level filters first for efficiency
     if min_score > 0:
-        query += " AND anomaly_score >= ?"
+        sql += " AND anomaly_score >= ?"
         params.append(min_score)
 
-    async with await get_db_connection() as db:
-        cursor = await db.execute(query, params)
-        all_devices_rows = await cursor.fetchall()
+    rows = await query.fetch_all(sql, params)
+    # JSON decoding and regex filtering of a large table is CPU work; keep it off the event loop too
+    return await query.run(_filter_device_rows, rows, mac_filter, ssid_filter, preset)
+
+def _filter_device_rows(rows: List[Dict], mac_filter: str, ssid_filter: str, preset: str) -> Dict:
+    filtered_devices = {}
+    mac_regex = re.compile(mac_filter, re.IGNORECASE) if mac_filter else None
+    ssid_regex = re.compile(ssid_filter, re.IGNORECASE) if ssid_filter else None
+    
+    for device_data in rows:
+        # Deserialize JSON fields
+        device_data['ssid_list'] = json.loads(device_data.get('ssid_list', '[]'))
+        device_data['rssi_list'] = json.loads(device_data.get('rssi_list', '[]'))
+        device_data['timestamps'] = json.loads(device_data.get('timestamps', '[]'))
+        device_data['channel_counts'] = json.loads(device_data.get('channel_counts', '{}'))
+        device_data['ssid_history'] = json.loads(device_data.get('ssid_history', '[]'))
         
-        filtered_devices = {}
-        mac_regex = re.compile(mac_filter, re.IGNORECASE) if mac_filter else None
-        ssid_regex = re.compile(ssid_filter, re.IGNORECASE) if ssid_filter else None
+        # Apply Python-side filters (especially for regex and 'recent' preset)
+        if mac_regex and not mac_regex.search(device_data['mac']):
+            continue
+        if ssid_regex and not any(ssid_regex.search(ssid) for ssid in device_data['ssid_list']):
+            continue
         
-        for row in all_devices_rows:
-            device_data = {k: row[k] for k in row.keys()} # Convert Row object to dict
-            
-            # Deserialize JSON fields
-            device_data['ssid_list'] = json.loads(device_data.get('ssid_list', '[]'))
-            device_data['rssi_list'] = json.loads(device_data.get('rssi_list', '[]'))
-            device_data['timestamps'] = json.loads(device_data.get('timestamps', '[]'))
-            device_data['channel_counts'] = json.loads(device_data.get('channel_counts', '{}'))
-            device_data['ssid_history'] = json.loads(device_data.get('ssid_history', '[]'))
-            
-            # Apply Python-side filters (especially for regex and 'recent' preset)
-            if mac_regex and not mac_regex.search(device_data['mac']):
+        if preset == "recent":
+            # Device timestamps are wall-clock ms (receive time)
+            cutoff_time_s = time.time() - 3600 # Last hour
+            # Check if *any* timestamp in the list is newer than cutoff
+            if not any(ts_ms / 1000.0 >= cutoff_time_s for ts_ms in device_data['timestamps']):
                 continue
-            if ssid_regex and not any(ssid_regex.search(ssid) for ssid in device_data['ssid_list']):
+        elif preset == "high_risk":
+            # This filter is already handled by `anomaly_score > 0.8 OR deauth_count > 5`
+            # which can be added directly to the SQL query for more efficiency.
+            # Adding it here to ensure it's always applied if preset is used.
+            if not (device_data['anomaly_score'] > 0.8 or device_data['deauth_count'] > 5):
                 continue
-            
-            if preset == "recent":
-                # Convert ESP's milliseconds timestamp to seconds for cutoff comparison
-                cutoff_time_s = time.time() - 3600 # Last hour
-                # Check if *any* timestamp in the list is newer than cutoff
-                if not any(ts_ms / 1000.0 >= cutoff_time_s for ts_ms in device_data['timestamps']):
-                    continue
-            elif preset == "high_risk":
-                # This filter is already handled by `anomaly_score > 0.8 OR deauth_count > 5`
-                # which can be added directly to the SQL query for more efficiency.
-                # Adding it here to ensure it's always applied if preset is used.
-                if not (device_data['anomaly_score'] > 0.8 or device_data['deauth_count'] > 5):
-                    continue
-
-            filtered_devices[device_data['mac']] = device_data
-            
+
+        filtered_devices[device_data['mac']] = device_data
+        
     return filtered_devices
 
 async def export_data(format: str, min_score: float = 0.0, mac_filter: str = "", ssid_filter: str = "", preset: str = "all") -> Dict:
@@ -157,10 +226,20 @@ async def ban_device(mac: str) -> Dict:
     async with await get_db_connection() as db:
         await db.execute("INSERT OR REPLACE INTO banned_macs (mac, banned_at) VALUES (?, ?)", (mac, time.time()))
         await db.commit()
+    if _banned_macs is not None:
+        _banned_macs.add(mac)
     return {"status": f"MAC {mac} added to ban list"}
 
-async def get_banned_macs() -> List[str]:
+async def refresh_banned_macs() -> Set[str]:
+    """Reloads the ban set from the database (e.g. after the blacklist is pruned)."""
+    global _banned_macs
     async with await get_db_connection() as db:
         cursor = await db.execute("SELECT mac FROM banned_macs")
         rows = await cursor.fetchall()
-        return [row['mac'] for row in rows]
\ No newline at end of file
+        _banned_macs = {row['mac'] for row in rows}
+    return _banned_macs
+
+async def get_banned_macs() -> Set[str]:
+    if _banned_macs is None:
+        return await refresh_banned_macs()
+    return _banned_macs
@@ -0,0 +1,148 @@
+# backend/ingest.py
+import time
+from typing import Dict, List, Optional, Tuple
+
+from backend import config
+
+# Ingest-stage coalescing and load shedding, applied between the serial queue and the analyzer.
+# Identical probes (same MAC, SSID, channel) inside COALESCE_SECONDS fold into one record; under
+# sustained queue backlog, probes from already-known devices are only folded into memory and a
+# sample of them is persisted. Deauths and never-seen MACs always take the full path.
+COALESCE_SECONDS = config.get_float("INGEST_COALESCE_SECONDS", 1.0)
+MAX_PENDING = 10000 # Distinct keys held at once; beyond this probes pass through uncoalesced
+SHED_QUEUE_HIGH = config.get_int("INGEST_SHED_QUEUE_HIGH", 1000) # Queue depth that counts as overload
+SHED_QUEUE_LOW = config.get_int("INGEST_SHED_QUEUE_LOW", 100)    # Depth that counts as recovered
+SHED_SUSTAIN_SECONDS = config.get_float("INGEST_SHED_SUSTAIN_SECONDS", 3.0) # Hysteresis for both transitions
+SHED_SAMPLE_EVERY = config.get_int("INGEST_SHED_SAMPLE_EVERY", 10) # While shedding, persist 1 in N known-device probes
+
+ProbeKey = Tuple[str, Optional[str], Optional[int]]
+
+
+class Coalescer:
+    """
+    Leading-edge coalescing: the first probe for a key goes through immediately, copies arriving
+    within COALESCE_SECONDS accumulate and come out as one merged record when the window closes.
+    A merged record keeps the last copy's fields and adds count, rssi_min/rssi_max and first_timestamp.
+    """
+
+    def __init__(self):
+        self.pending: Dict[ProbeKey, Dict] = {} # key -> {"opened": float, "record": merged record or None}
+        self.merged = 0 # Records saved: copies folded into a merged record beyond the one it emits
+
+    def offer(self, record: Dict, now: Optional[float] = None) -> Optional[Dict]:
+        """Returns the record to process now, or None if it was folded into a pending one."""
+        if record.get("type") != "probe" or not record.get("mac"):
+            return record
+        now = now or time.time()
+        key = (record["mac"], record.get("ssid"), record.get("channel"))
+        entry = self.pending.get(key)
+        if entry is None:
+            if len(self.pending) < MAX_PENDING:
+                self.pending[key] = {"opened": now, "record": None}
+            return record
+
+        rssi = record.get("rssi")
+        merged = entry["record"]
+        if merged is None:
+            entry["record"] = {
+                **record,
+                "count": 1,
+                "rssi_min": rssi,
+                "rssi_max": rssi,
+                "first_timestamp": record.get("timestamp"),
+            }
+            return None
+        first_timestamp, rssi_min, rssi_max, count = (merged["first_timestamp"], merged["rssi_min"],
+                                                      merged["rssi_max"], merged["count"])
+        merged.update(record)
+        merged["count"] = count + 1
+        self.merged += 1
+        merged["first_timestamp"] = first_timestamp
+        if rssi is not None:
+            merged["rssi_min"] = rssi if rssi_min is None else min(rssi_min, rssi)
+            merged["rssi_max"] = rssi if rssi_max is None else max(rssi_max, rssi)
+        return None
+
+    def expired(self, now: Optional[float] = None) -> List[Dict]:
+        """Closes windows older than COALESCE_SECONDS and returns their merged records."""
+        now = now or time.time()
+        due = []
+        # Keys are only inserted when a window opens, so dict order is opening order: stop at the first open one
+        for key, entry in self.pending.items():
+            if now - entry["opened"] < COALESCE_SECONDS:
+                break
+            due.append(key)
+        # Windows are dropped once closed, so the next copy of a key is a fresh leading edge
+        records = [self.pending.pop(key)["record"] for key in due]
+        return [r for r in records if r is not None]
+
+
+class LoadShedder:
+    """Queue-depth driven overload switch with hysteresis, plus the sampling decision."""
+
+    def __init__(self):
+        self.shedding = False
+        self._over_since: Optional[float] = None
+        self._under_since: Optional[float] = None
+        self._sample_counter = 0
+        self.shed = 0 # Probes kept in memory only, without scoring or DB writes
+        self.transitions: List[Dict] = []
+
+    def update(self, depth: int, now: Optional[float] = None):
+        now = now or time.time()
+        if not self.shedding:
+            if depth < SHED_QUEUE_HIGH:
+                self._over_since = None
+            elif self._over_since is None:
+                self._over_since = now
+            elif now - self._over_since >= SHED_SUSTAIN_SECONDS:
+                self._switch(True, depth, now)
+        else:
+            if depth > SHED_QUEUE_LOW:
+                self._under_since = None
+            elif self._under_since is None:
+                self._under_since = now
+            elif now - self._under_since >= SHED_SUSTAIN_SECONDS:
+                self._switch(False, depth, now)
+
+    def _switch(self, shedding: bool, depth: int, now: float):
+        self.shedding = shedding
+        self._over_since = self._under_since = None
+        self.transitions = (self.transitions + [{"at": now, "shedding": shedding, "queue_depth": depth}])[-20:]
+        print(f"Ingest load shedding {'ON' if shedding else 'OFF'} (queue depth {depth})")
+
+    def should_shed(self, record: Dict, known: bool) -> bool:
+        """True if this record should skip scoring/persistence. Only known-device probes are ever shed."""
+        if not self.shedding or record.get("type") != "probe" or not known:
+            return False
+        self._sample_counter += 1
+        if self._sample_counter % SHED_SAMPLE_EVERY == 0:
+            return False # Sampled: persisted with the aggregates folded in since the last sample
+        self.shed += 1
+        return True
+
+
+coalescer = Coalescer()
+shedder = LoadShedder()
+_received = 0
+_peak_depth = 0
+
+def note_received(depth: int):
+    global _received, _peak_depth
+    _received += 1
+    _peak_depth = max(_peak_depth, depth)
+    shedder.update(depth)
+
+def get_stats(depth: int) -> Dict:
+    return {
+        "received": _received,
+        "merged": coalescer.merged,
+        "pending_windows": len(coalescer.pending),
+        "shed": shedder.shed,
+        "shedding": shedder.shedding,
+        "queue_depth": depth,
+        "peak_queue_depth": _peak_depth,
+        "coalesce_seconds": COALESCE_SECONDS,
+        "shed_sample_every": SHED_SAMPLE_EVERY,
+        "transitions": shedder.transitions,
+    }
@@ -1,13 +1,15 @@
-from fastapi import FastAPI, WebSocket, Request, HTTPException, Form
+from fastapi import FastAPI, WebSocket, WebSocketDisconnect, Request, HTTPException, Form
 from fastapi.templating import Jinja2Templates
-from fastapi.responses import HTMLResponse, JSONResponse
+from fastapi.responses import HTMLResponse, JSONResponse, StreamingResponse, Response
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles # NEW IMPORT
 import asyncio
 import json
 from collections import deque
 import os # NEW IMPORT (needed for os.path.join)
+import hashlib
 import time # Used for timestamp comparison in anomaly detection (though mostly handled by ESP's ms timestamp)
+from typing import Dict, Optional
 
 # Import updated modules
 from backend.database.database import init_db, get_db_connection, get_setting, set_setting
@@ -16,6 +18,16 @@ from backend import analyzer
 from backend import alerts
 from backend import exporter
 from backend import cleanup
+from backend import state
+from backend import snapshot
+from backend import archive
+from backend import downsample
+from backend import subscriptions
+from backend import channels
+from backend import deauth_monitor
+from backend import cardinality
+from backend import ingest
+from backend import query
 
 app = FastAPI()
 templates = Jinja2Templates(directory="frontend/templates")
@@ -44,12 +56,43 @@ serial_data_queue: asyncio.Queue = asyncio.Queue()
 @app.on_event("startup")
 async def startup_event():
     await init_db()
-    # Read initial ESP config from DB and set serial_reader's config
-    # The actual sending to ESP happens when requested by UI via /esp-config endpoint
-    # The serial_reader module needs its internal port config set, which run.sh handles.
-    
+    # Serial port/baud come from sigvoid.conf or the environment when serial_reader is imported.
+    # The actual sending of AP settings to the ESP happens when requested by UI via /esp-config endpoint.
+
+    # Warm start: restore device aggregates, cooldowns and vendor cache before reading packets
+    await snapshot.load_snapshot()
+    await exporter.refresh_banned_macs() # Bans come from their table, so none added since the last snapshot are lost
+    asyncio.create_task(snapshot.snapshot_loop())
+    asyncio.create_task(archive.flush_loop())
+    asyncio.create_task(channels.rollup_loop())
+    await cardinality.load_history()
+    asyncio.create_task(cardinality.rollup_loop())
+    asyncio.create_task(deauth_monitor.tick_loop())
+    if channels.PLAN_AUTO:
+        asyncio.create_task(channels.plan_loop())
+
+    # Seed the dashboard index: hot devices from the snapshot win over their (older) DB rows
+    for mac, device in (await exporter.get_filtered_devices()).items():
+        subscriptions.device_index.update(mac, state.devices.get(mac, device))
+    for mac, device in state.devices.items():
+        subscriptions.device_index.update(mac, device)
+
     # Start the serial reading task in the background
     asyncio.create_task(serial_reader.read_serial_async_queue(serial_data_queue))
+    asyncio.create_task(ingest_loop())
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    await snapshot.save_snapshot()
+    await archive.close()
+    await channels.flush()
+    await cardinality.flush()
+    query.close()
+
+@app.exception_handler(query.QueryTimeout)
+async def query_timeout_handler(request: Request, exc: query.QueryTimeout):
+    # A read that ran too long is cut off on the query pool; ingest never waited on it
+    return JSONResponse(status_code=504, content={"detail": str(exc)})
 
 @app.get("/", response_class=HTMLResponse)
 async def index(request: Request):
@@ -73,6 +116,123 @@ async def cleanup_storage():
     await cleanup.prune_blacklist() # Also prune blacklist during general cleanup
     return JSONResponse(content=response)
 
+@app.get("/archive/records")
+async def archive_records(start: Optional[float] = None, end: Optional[float] = None, mac: str = ""):
+    # Streams raw archived records (NDJSON) straight from the segment files, no SQLite involved
+    end = end if end is not None else time.time()
+    start = start if start is not None else end - 3600
+    if start > end:
+        raise HTTPException(status_code=400, detail="start must be before end")
+    return StreamingResponse(archive.iter_records_ndjson(start, end, mac or None), media_type="application/x-ndjson")
+
+@app.get("/archive/stats")
+async def archive_stats():
+    return JSONResponse(content=archive.get_stats())
+
+@app.post("/archive/replay")
+async def archive_replay(start: float, end: float, mac: str = ""):
+    """Rebuilds (replaces) the aggregates of devices seen in [start, end]; see archive.replay."""
+    if start > end:
+        raise HTTPException(status_code=400, detail="start must be before end")
+    await archive.flush() # Make sure buffered records are part of the replay
+    response = await archive.replay(start, end, mac or None)
+    return JSONResponse(content=response)
+
+@app.get("/devices/{mac}/timeline")
+async def device_timeline(request: Request, mac: str, start: Optional[float] = None, end: Optional[float] = None, points: int = 300):
+    end = end if end is not None else time.time()
+    start = start if start is not None else end - 3600
+    if start > end:
+        raise HTTPException(status_code=400, detail="start must be before end")
+    points = max(3, min(points, 5000))
+    mac = mac.upper() # Stored as the sensor reports it (upper case), same as the archive lookup
+
+    # Appends only ever add rows (and cleanup only removes them), so count, newest id and the first/last
+    # timestamps identify the range's contents. The ETag is built from those, not from start/end: the default
+    # end is "now", which would otherwise give every poll a new tag.
+    row_count, max_id, first_ts, last_ts = await exporter.get_timeline_version(mac, start, end)
+    etag = '"' + hashlib.sha1(f"{mac}|{points}|{row_count}|{max_id}|{first_ts}|{last_ts}".encode()).hexdigest() + '"'
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers={"ETag": etag})
+
+    rows = await exporter.get_device_timeline(mac, start, end)
+    # Rows logged without a channel (deauths from older firmware) have no radio data; they only feed the score series
+    radio_rows = [r for r in rows if r["channel"]]
+    series = {
+        "rssi": downsample.lttb([(r["timestamp"], r["rssi"]) for r in radio_rows], points),
+        "channel": downsample.lttb([(r["timestamp"], r["channel"]) for r in radio_rows], points),
+        "anomaly_score": downsample.lttb([(r["timestamp"], r["anomaly_score"]) for r in rows], points),
+    }
+    return JSONResponse(
+        content={
+            "mac": mac,
+            "start": start,
+            "end": end,
+            "total_points": row_count,
+            # [[t, value], ...] keeps the payload compact; t is epoch seconds
+            "series": {name: [[round(t, 3), v] for t, v in pts] for name, pts in series.items()},
+        },
+        headers={"ETag": etag, "Cache-Control": "no-cache"} # Always revalidate, usually answered by 304
+    )
+
+@app.get("/channels/heatmap")
+async def channel_heatmap(start: Optional[float] = None, end: Optional[float] = None, bucket_seconds: int = channels.BUCKET_SECONDS):
+    end = end if end is not None else time.time()
+    start = start if start is not None else end - 3600
+    if start > end:
+        raise HTTPException(status_code=400, detail="start must be before end")
+    # Same rounding get_heatmap applies, so the bucket count checked is the one it will build
+    bucket_seconds = max(channels.BUCKET_SECONDS, bucket_seconds - bucket_seconds % channels.BUCKET_SECONDS)
+    if (end - start) / bucket_seconds > 10000:
+        raise HTTPException(status_code=400, detail="Too many buckets; increase bucket_seconds")
+    return JSONResponse(content=await channels.get_heatmap(start, end, bucket_seconds))
+
+@app.get("/channels/plan")
+async def get_channel_plan():
+    # Preview of what would be pushed, plus the last plan the sensor actually received
+    return JSONResponse(content={"proposed": await channels.compute_hop_plan(), "active": channels.get_last_plan()})
+
+@app.post("/channels/plan")
+async def push_channel_plan():
+    plan = await channels.push_hop_plan()
+    if not plan["sent"]:
+        raise HTTPException(status_code=500, detail="Failed to send channel plan to ESP8266. Check serial connection.")
+    return JSONResponse(content=plan)
+
+@app.get("/deauth/stats")
+async def deauth_stats():
+    return JSONResponse(content=deauth_monitor.monitor.get_stats())
+
+@app.get("/deauth/incidents")
+async def deauth_incidents():
+    return JSONResponse(content={"incidents": deauth_monitor.monitor.get_incidents()})
+
+@app.get("/stats/distinct")
+async def distinct_stats(window: int = 3600, scope: str = "all"):
+    """
+    Approximate distinct MACs/SSIDs over the last `window` seconds (HyperLogLog, ~3% error).
+    scope is "all", "sensor:<id>" or "channel:<n>"; "all" is answered from memory for windows up to 24h.
+    """
+    if window <= 0:
+        raise HTTPException(status_code=400, detail="window must be positive")
+    if scope != "all" and not scope.startswith(("sensor:", "channel:")):
+        raise HTTPException(status_code=400, detail="scope must be 'all', 'sensor:<id>' or 'channel:<n>'")
+    return JSONResponse(content={
+        "window": window,
+        "scope": scope,
+        "macs": await cardinality.count_scoped("mac", scope, window),
+        "ssids": await cardinality.count_scoped("ssid", scope, window),
+    })
+
+@app.get("/ingest/stats")
+async def ingest_stats():
+    # Coalesced duplicates and shed probes, so overload shows up as numbers rather than a growing queue
+    return JSONResponse(content=ingest.get_stats(serial_data_queue.qsize()))
+
+@app.get("/query/stats")
+async def query_stats():
+    return JSONResponse(content=query.get_stats())
+
 @app.get("/diagnostics")
 async def get_diagnostics():
     return JSONResponse(content=diagnostics_data)
@@ -98,135 +258,183 @@ async def update_esp_config(ssid: str = Form(...), password: str = Form(...)):
         raise HTTPException(status_code=500, detail="Failed to send config to ESP8266. Check serial connection.")
 
 
-@app.websocket("/ws")
-async def websocket_endpoint(websocket: WebSocket):
-    await websocket.accept()
-    
-    # Send initial state
-    current_devices = await exporter.get_filtered_devices() # Fetch all current devices from DB
-    await websocket.send_json({
-        "devices": current_devices,
-        "diagnostics": diagnostics_data
-    })
+async def process_record(data: Dict):
+    """Handles one record from the sensor: diagnostics, ESP messages, or a probe/deauth packet."""
+    if data["type"] == "diagnostics":
+        diagnostics_data.update({
+            "free_heap": data.get("free_heap", 0),
+            "uptime": data.get("uptime", 0) / 1000.0 # Convert to seconds
+        })
+    elif data["type"] == "info" or data["type"] == "error":
+        # Handle ESP info/error messages, could log them or push to UI as toasts
+        print(f"ESP Message: {data.get('message')}")
+    else: # Packet data (probe or deauth)
+        mac = data.get("mac")
+        if not mac:
+            print(f"Received data without MAC: {data}")
+            return
+
+        packet_type = data["type"]
+
+        if packet_type == "deauth":
+            decision = deauth_monitor.monitor.observe(data)
+            if decision["incident"]:
+                await alerts.send_incident_alert(decision["incident"])
+            if not decision["persist"] and mac not in state.devices:
+                # Forged one-off source during a flood: counted by the monitor and archived,
+                # but no devices/logs row, so a spoofed flood can't bloat the tables
+                await channels.record_packet(data, count_mac=False)
+                return
+
+        if ingest.shedder.should_shed(data, mac in state.devices):
+            # Overload: fold into the in-memory aggregates only; the next sampled probe scores and persists them
+            device_data_db = state.devices[mac]
+            analyzer.apply_packet(device_data_db, data)
+            await channels.record_packet(data)
+            await cardinality.record_packet(data)
+            subscriptions.device_index.update(mac, device_data_db)
+            return
+
+        async with await get_db_connection() as db:
+            # Hot path: device already in memory (live or restored from snapshot)
+            device_data_db = state.devices.get(mac)
+            if device_data_db is None:
+                # Fetch existing device data from DB
+                device_data_db = await exporter.load_device_state(db, mac)
+                if device_data_db is None:
+                    # Initialize new device data
+                    device_data_db = analyzer.new_device(await analyzer.oui_lookup(mac))
+                state.devices[mac] = device_data_db
+
+            analyzer.apply_packet(device_data_db, data)
+            await channels.record_packet(data)
+            await cardinality.record_packet(data) # Forged flood sources (returned above) stay out of the distinct counts
+
+            if packet_type == "probe":
+                ssid = data.get("ssid")
+                bssid = data.get("bssid")
+
+                # Calculate scores based on updated data
+                # Adaptive weights use device density: distinct MACs over the last hour, from the HLL sketches
+                device_data_db["anomaly_score"] = analyzer.calculate_anomaly_score(device_data_db, cardinality.device_density())
+                device_data_db["persistence_score"] = analyzer.calculate_persistence_score(device_data_db)
+                device_data_db["pattern_score"] = analyzer.calculate_pattern_score(device_data_db)
+
+                if await analyzer.detect_evil_twin(db, mac, ssid, bssid):
+                    device_data_db["anomaly_score"] = min(1.0, device_data_db["anomaly_score"] + 0.3) # Boost score for evil twin
+
+            elif packet_type == "deauth":
+                device_data_db["anomaly_score"] = analyzer.calculate_anomaly_score(device_data_db, cardinality.device_density())
+
+            # Check if MAC is banned and update anomaly score if needed
+            banned_macs = await exporter.get_banned_macs()
+            if mac in banned_macs:
+                device_data_db["anomaly_score"] = max(device_data_db["anomaly_score"], 0.95) # Flag banned as very high risk
+                # print(f"Banned MAC {mac} detected and score boosted!") # Debugging
+
+            # Update device state in DB
+            await exporter.upsert_device_state(mac, device_data_db)
 
+            # Log raw packet to DB
+            await exporter.log_packet_to_db(mac, data, device_data_db) # Pass full packet data and current device summary
+
+            # Send alert if thresholds are met. Deauths use the recent-window rate rather than the
+            # lifetime deauth_count, so a device doesn't stay "alerting" forever after one burst.
+            recent_deauths = deauth_monitor.monitor.source_estimate(mac)
+            if device_data_db["anomaly_score"] > 0.8 or recent_deauths > deauth_monitor.SOURCE_ALERT_THRESHOLD:
+                await alerts.send_alert(mac, device_data_db)
+
+        # Dashboards are pushed from the index, only when this change touches their window
+        subscriptions.device_index.update(mac, device_data_db)
+
+async def ingest_loop():
+    """
+    Single consumer of the serial queue. Runs whether or not any dashboard is connected;
+    websocket clients only read from the device index.
+    """
     while True:
         try:
-            # Get data from the queue (non-blocking)
-            data = await serial_data_queue.get() 
-            
-            if data["type"] == "diagnostics":
-                diagnostics_data.update({
-                    "free_heap": data.get("free_heap", 0),
-                    "uptime": data.get("uptime", 0) / 1000.0 # Convert to seconds
-                })
-            elif data["type"] == "info" or data["type"] == "error":
-                # Handle ESP info/error messages, could log them or push to UI as toasts
-                print(f"ESP Message: {data.get('message')}")
-            else: # Packet data (probe or deauth)
-                mac = data.get("mac")
-                if not mac:
-                    print(f"Received data without MAC: {data}")
-                    continue
-
-                packet_type = data["type"]
-                timestamp_ms = data.get("timestamp")
-                
-                async with await get_db_connection() as db:
-                    # Fetch existing device data from DB
-                    cursor = await db.execute("SELECT * FROM devices WHERE mac = ?", (mac,))
-                    row = await cursor.fetchone()
-                    
-                    device_data_db = {}
-                    if row:
-                        device_data_db = {k: row[k] for k in row.keys()}
-                        # Deserialize JSON fields from DB
-                        device_data_db['ssid_list'] = set(json.loads(device_data_db.get('ssid_list', '[]'))) # Convert to set
-                        device_data_db['rssi_list'] = json.loads(device_data_db.get('rssi_list', '[]'))
-                        device_data_db['timestamps'] = json.loads(device_data_db.get('timestamps', '[]'))
-                        device_data_db['channel_counts'] = json.loads(device_data_db.get('channel_counts', '{}'))
-                        device_data_db['ssid_history'] = deque(json.loads(device_data_db.get('ssid_history', '[]')), maxlen=analyzer.MAX_SSID_HISTORY) # Re-create deque
-                    else:
-                        # Initialize new device data
-                        device_data_db = {
-                            "vendor": await analyzer.oui_lookup(mac),
-                            "ssid_list": set(),
-                            "rssi_list": [],
-                            "timestamps": [],
-                            "deauth_count": 0,
-                            "channel_counts": {},
-                            "ssid_history": deque(maxlen=analyzer.MAX_SSID_HISTORY),
-                            "anomaly_score": 0.0,
-                            "persistence_score": 0.0,
-                            "pattern_score": 0.0,
-                        }
-                    
-                    if packet_type == "probe":
-                        ssid = data.get("ssid")
-                        rssi = data.get("rssi")
-                        channel = data.get("channel")
-                        bssid = data.get("bssid")
-
-                        if ssid:
-                            device_data_db["ssid_list"].add(ssid)
-                            device_data_db["ssid_history"].append(ssid) # Add to history
-                        if rssi is not None:
-                            device_data_db["rssi_list"].append(rssi)
-                        if timestamp_ms:
-                            device_data_db["timestamps"].append(timestamp_ms)
-                        if channel:
-                            device_data_db["channel_counts"][str(channel)] = device_data_db["channel_counts"].get(str(channel), 0) + 1
-                        
-                        # Keep lists from growing indefinitely (e.g., last 500 points)
-                        MAX_DATA_POINTS = 500
-                        device_data_db["rssi_list"] = device_data_db["rssi_list"][-MAX_DATA_POINTS:]
-                        device_data_db["timestamps"] = device_data_db["timestamps"][-MAX_DATA_POINTS:]
-
-                        # Calculate scores based on updated data
-                        # We need total_devices for adaptive anomaly scoring, so fetch dynamically
-                        total_devices_cursor = await db.execute("SELECT COUNT(*) FROM devices")
-                        total_devices = (await total_devices_cursor.fetchone())[0] # Get count of devices in DB
-                        
-                        device_data_db["anomaly_score"] = analyzer.calculate_anomaly_score(device_data_db, total_devices)
-                        device_data_db["persistence_score"] = analyzer.calculate_persistence_score(device_data_db)
-                        device_data_db["pattern_score"] = analyzer.calculate_pattern_score(device_data_db)
-
-                        if await analyzer.detect_evil_twin(db, mac, ssid, bssid):
-                            device_data_db["anomaly_score"] = min(1.0, device_data_db["anomaly_score"] + 0.3) # Boost score for evil twin
-                    
-                    elif packet_type == "deauth":
-                        device_data_db["deauth_count"] = device_data_db.get("deauth_count", 0) + 1
-                        total_devices_cursor = await db.execute("SELECT COUNT(*) FROM devices")
-                        total_devices = (await total_devices_cursor.fetchone())[0]
-                        device_data_db["anomaly_score"] = analyzer.calculate_anomaly_score(device_data_db, total_devices)
-                    
-                    # Check if MAC is banned and update anomaly score if needed
-                    banned_macs = await exporter.get_banned_macs()
-                    if mac in banned_macs:
-                        device_data_db["anomaly_score"] = max(device_data_db["anomaly_score"], 0.95) # Flag banned as very high risk
-                        # print(f"Banned MAC {mac} detected and score boosted!") # Debugging
-
-                    # Update device state in DB
-                    await exporter.upsert_device_state(mac, device_data_db)
-                    
-                    # Log raw packet to DB
-                    await exporter.log_packet_to_db(mac, data, device_data_db) # Pass full packet data and current device summary
-
-                    # Send alert if thresholds are met
-                    if device_data_db["anomaly_score"] > 0.8 or device_data_db["deauth_count"] > 5:
-                        await alerts.send_alert(mac, device_data_db)
-                
-                # Fetch all devices again to ensure all filters and updates are applied for UI
-                # This is more robust than trying to update Alpine store piece by piece
-                current_devices = await exporter.get_filtered_devices()
-                
-            # Send the updated state to the connected WebSocket client
-            await websocket.send_json({
-                "devices": current_devices,
-                "diagnostics": diagnostics_data
-            })
+            if serial_data_queue.empty():
+                try:
+                    # Wake up periodically so coalescing windows close even when the sensor goes quiet
+                    data = await asyncio.wait_for(serial_data_queue.get(), timeout=ingest.COALESCE_SECONDS / 2)
+                except asyncio.TimeoutError:
+                    data = None
+            else:
+                data = serial_data_queue.get_nowait()
+
+            if data is not None:
+                ingest.note_received(serial_data_queue.qsize())
+                await archive.append(data) # Raw capture archive keeps every record, uncoalesced
+                data = ingest.coalescer.offer(data) # None when folded into a pending duplicate
+                if data is not None:
+                    await process_record(data)
+            for merged in ingest.coalescer.expired():
+                await process_record(merged)
         except asyncio.CancelledError:
-            print("WebSocket disconnected.")
-            break # Exit loop if client disconnects
+            break
         except Exception as e:
-            print(f"WebSocket processing error: {e}")
-            await asyncio.sleep(1) # Prevent tight loop on error
\ No newline at end of file
+            print(f"Ingest processing error: {e}")
+            await asyncio.sleep(1) # Prevent tight loop on error
+
+async def _push_window_updates(websocket: WebSocket, subscription: subscriptions.Subscription):
+    """
+    Pushes window diffs (and diagnostics when they change) to one client, at most every PUSH_INTERVAL_SECONDS,
+    plus distinct counts every DISTINCT_PUSH_SECONDS when they change (they drift with time, not with the window).
+    """
+    last_diagnostics = None
+    last_distinct, distinct_checked = None, 0.0
+    while True:
+        message = subscription.next_update(subscriptions.device_index)
+        if message:
+            await websocket.send_json(message)
+        if time.time() - distinct_checked >= subscriptions.DISTINCT_PUSH_SECONDS:
+            distinct_checked = time.time()
+            distinct = cardinality.summary()
+            if distinct != last_distinct:
+                last_distinct = distinct
+                await websocket.send_json({"type": "distinct", "distinct": distinct})
+        if diagnostics_data != last_diagnostics:
+            last_diagnostics = dict(diagnostics_data)
+            await websocket.send_json({"type": "diagnostics", "diagnostics": last_diagnostics})
+        await asyncio.sleep(subscriptions.PUSH_INTERVAL_SECONDS)
+
+async def _receive_views(websocket: WebSocket, subscription: subscriptions.Subscription):
+    while True:
+        message = await websocket.receive_json()
+        if message.get("type") == "subscribe":
+            error = subscription.set_view(message)
+            if error:
+                await websocket.send_json({"type": "error", "message": error})
+
+@app.websocket("/ws")
+async def websocket_endpoint(websocket: WebSocket):
+    """
+    Windowed device subscription. The client sends
+      {"type": "subscribe", "sort": ..., "order": "asc"|"desc", "offset": ..., "limit": ...,
+       "mac_filter": ..., "ssid_filter": ..., "min_score": ..., "preset": ...}
+    whenever its view changes (scrolling is just a new offset) and receives "window" messages
+    carrying only rows that entered or changed, the row order, and site-wide counts, plus
+    "diagnostics" and "distinct" (unique MAC/SSID estimates) messages on their own schedules.
+    """
+    await websocket.accept()
+    subscription = subscriptions.Subscription()
+    receiver = asyncio.create_task(_receive_views(websocket, subscription))
+    pusher = asyncio.create_task(_push_window_updates(websocket, subscription))
+    try:
+        # Whichever side stops first ends the connection; a dead pusher must not leave a silent socket open
+        done, _ = await asyncio.wait({receiver, pusher}, return_when=asyncio.FIRST_COMPLETED)
+        for task in done:
+            error = task.exception()
+            if isinstance(error, WebSocketDisconnect):
+                print("WebSocket disconnected.")
+            elif error is not None:
+                print(f"WebSocket {'push' if task is pusher else 'processing'} error: {error}")
+        if pusher in done:
+            try:
+                await websocket.close(code=1011) # Client reconnects and re-subscribes
+            except Exception:
+                pass # Already gone
+    finally:
+        receiver.cancel()
+        pusher.cancel()
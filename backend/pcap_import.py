@@ -0,0 +1,406 @@
+# backend/pcap_import.py
+"""
+Offline import of 802.11 monitor-mode captures (pcap / pcapng).
+
+    python -m backend.pcap_import [-j JOBS] capture1.pcapng capture2.pcap ...
+
+Run from the project root with the backend stopped. Files are parsed in a process pool;
+probe requests and deauth/disassoc frames become the same records the ESP sends over serial
+(plus radiotap RSSI/channel) and are folded through analyzer.apply_packet and the analyzer
+scores into the devices and logs tables. Writes go through one connection in large
+transactions, with the logs index dropped for the load and rebuilt once at the end.
+
+Once every file is parsed, the spools are merged in capture-time order, so each device's
+records are applied oldest first even when captures overlap or finish parsing out of order.
+Capture time is the records' receive time ("t"), the same wall clock live device timestamps
+use. Frames whose (MAC, capture time) is already in logs are skipped, so re-importing a
+capture doesn't count it twice.
+"""
+import argparse
+import asyncio
+import heapq
+import os
+import pickle
+import struct
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Iterator, List, Optional, Set, Tuple
+
+from backend import analyzer
+from backend import cardinality
+from backend import exporter
+from backend import snapshot
+from backend.database.database import init_db, get_db_connection
+
+LINKTYPE_IEEE802_11 = 105
+LINKTYPE_IEEE802_11_RADIOTAP = 127
+CHUNK_RECORDS = 20000   # Records per pickle chunk handed from a parser process to the loader
+LOG_BATCH_ROWS = 50000  # Log rows per transaction
+RESCORE_EVERY = 20      # Rescore a device every N of its packets (and once at the end); logs carry the latest scores
+
+# --- Capture file readers: yield (linktype, capture time in seconds, frame bytes) ---
+
+def _iter_pcap(f, header: bytes) -> Iterator[Tuple[int, float, bytes]]:
+    magic = header[:4]
+    if magic in (b"\xd4\xc3\xb2\xa1", b"\x4d\x3c\xb2\xa1"):
+        endian = "<"
+    else:
+        endian = ">"
+    nanosecond = magic in (b"\x4d\x3c\xb2\xa1", b"\xa1\xb2\x3c\x4d")
+    linktype = struct.unpack(endian + "I", header[20:24])[0] & 0x0FFFFFFF
+    record_header = struct.Struct(endian + "IIII")
+    while True:
+        raw = f.read(16)
+        if len(raw) < 16:
+            return
+        ts_sec, ts_frac, incl_len, _ = record_header.unpack(raw)
+        data = f.read(incl_len)
+        if len(data) < incl_len:
+            return # Truncated capture
+        yield linktype, ts_sec + ts_frac / (1e9 if nanosecond else 1e6), data
+
+def _iter_pcapng(f) -> Iterator[Tuple[int, float, bytes]]:
+    endian = "<"
+    interfaces: List[Tuple[int, float]] = [] # (linktype, seconds per timestamp unit) per interface id
+    last_ts = 0.0
+    while True:
+        head = f.read(8)
+        if len(head) < 8:
+            return
+        if head[:4] == b"\x0a\x0d\x0d\x0a": # Section header: byte order is set per section
+            byte_order = f.read(4)
+            endian = "<" if byte_order == b"\x4d\x3c\x2b\x1a" else ">"
+            interfaces = []
+            block_len = struct.unpack(endian + "I", head[4:8])[0]
+            body = byte_order + f.read(max(block_len - 12, 0))
+        else:
+            block_len = struct.unpack(endian + "I", head[4:8])[0]
+            body = f.read(max(block_len - 8, 0))
+        if block_len < 12 or len(body) < block_len - 8:
+            return # Corrupt or truncated capture
+        block_type = struct.unpack(endian + "I", head[:4])[0]
+        block = head + body
+        if block_type == 0x00000001: # Interface description
+            linktype = struct.unpack(endian + "H", block[8:10])[0]
+            interfaces.append((linktype, _pcapng_tsresol(block[16:block_len - 4], endian)))
+        elif block_type == 0x00000006: # Enhanced packet
+            iface, ts_high, ts_low, cap_len = struct.unpack(endian + "IIII", block[8:24])
+            if iface < len(interfaces):
+                linktype, unit = interfaces[iface]
+                last_ts = ((ts_high << 32) | ts_low) * unit
+                yield linktype, last_ts, block[28:28 + cap_len]
+        elif block_type == 0x00000003 and interfaces: # Simple packet: interface 0, no timestamp
+            orig_len = struct.unpack(endian + "I", block[8:12])[0]
+            yield interfaces[0][0], last_ts, block[12:12 + min(orig_len, block_len - 16)]
+
+def _pcapng_tsresol(options: bytes, endian: str) -> float:
+    """if_tsresol option of an interface block; microseconds when absent."""
+    i = 0
+    while i + 4 <= len(options):
+        code, length = struct.unpack(endian + "HH", options[i:i + 4])
+        if code == 0:
+            break
+        if code == 9 and length >= 1:
+            value = options[i + 4]
+            return 2.0 ** -(value & 0x7F) if value & 0x80 else 10.0 ** -value
+        i += 4 + length + (-length % 4)
+    return 1e-6
+
+def iter_frames(path: str) -> Iterator[Tuple[int, float, bytes]]:
+    with open(path, "rb") as f:
+        header = f.read(24)
+        if header[:4] == b"\x0a\x0d\x0d\x0a":
+            f.seek(0)
+            yield from _iter_pcapng(f)
+        elif header[:4] in (b"\xd4\xc3\xb2\xa1", b"\xa1\xb2\xc3\xd4", b"\x4d\x3c\xb2\xa1", b"\xa1\xb2\x3c\x4d"):
+            yield from _iter_pcap(f, header)
+        else:
+            raise ValueError("not a pcap or pcapng file")
+
+# --- Frame parsing ---
+
+# Radiotap fields up to dBm antenna signal: bit -> (alignment, size)
+_RADIOTAP_FIELDS = {0: (8, 8), 1: (1, 1), 2: (1, 1), 3: (2, 4), 4: (1, 2), 5: (1, 1)}
+
+def _freq_to_channel(freq: int) -> Optional[int]:
+    if freq == 2484:
+        return 14
+    if 2412 <= freq < 2484:
+        return (freq - 2407) // 5
+    if 5000 <= freq < 5900:
+        return (freq - 5000) // 5
+    if 5950 <= freq <= 7125:
+        return (freq - 5950) // 5
+    return None
+
+def _parse_radiotap(data: bytes) -> Optional[Tuple[int, Optional[int], Optional[int], bool]]:
+    """(header length, RSSI dBm, channel, FCS present) or None if the header is malformed."""
+    if len(data) < 8:
+        return None
+    length, present = struct.unpack_from("<HI", data, 2)
+    if length > len(data):
+        return None
+    offset = 8
+    word = present
+    while word & 0x80000000: # Extended presence bitmaps; only the first word's fields are read
+        if offset + 4 > length:
+            return None
+        word = struct.unpack_from("<I", data, offset)[0]
+        offset += 4
+    rssi = channel = None
+    fcs = False
+    for bit in range(6):
+        if not present & (1 << bit):
+            continue
+        align, size = _RADIOTAP_FIELDS[bit]
+        offset += -offset % align
+        if offset + size > length:
+            break
+        if bit == 1:
+            fcs = bool(data[offset] & 0x10)
+        elif bit == 3:
+            channel = _freq_to_channel(struct.unpack_from("<H", data, offset)[0])
+        elif bit == 5:
+            rssi = struct.unpack_from("<b", data, offset)[0]
+        offset += size
+    return length, rssi, channel, fcs
+
+def _mac(raw: bytes) -> str:
+    return ":".join(f"{b:02X}" for b in raw) # Same format as the ESP's %02X output
+
+def parse_frame(linktype: int, ts: float, data: bytes) -> Optional[Dict]:
+    """A probe/deauth record in the ESP's serial format, or None for any other frame."""
+    rssi = channel = None
+    if linktype == LINKTYPE_IEEE802_11_RADIOTAP:
+        radiotap = _parse_radiotap(data)
+        if radiotap is None:
+            return None
+        length, rssi, channel, fcs = radiotap
+        data = data[length:-4] if fcs else data[length:]
+    elif linktype != LINKTYPE_IEEE802_11:
+        return None
+    if len(data) < 24:
+        return None
+
+    fc = data[0]
+    if (fc >> 2) & 0x3 != 0: # Management frames only
+        return None
+    subtype = fc >> 4
+    timestamp_ms = int(ts * 1000)
+    if subtype == 4: # Probe request
+        ssid = ""
+        i = 24
+        while i + 2 <= len(data):
+            tag, tag_len = data[i], data[i + 1]
+            value = data[i + 2:i + 2 + tag_len]
+            if tag == 0:
+                ssid = value.decode("utf-8", errors="replace")
+            elif tag == 3 and channel is None and tag_len == 1: # DS parameter set
+                channel = value[0]
+            i += 2 + tag_len
+        return {"type": "probe", "mac": _mac(data[10:16]), "bssid": _mac(data[16:22]), "ssid": ssid,
+                "rssi": rssi if rssi is not None else 0, "channel": channel or 0, "timestamp": timestamp_ms, "t": ts}
+    if subtype in (10, 12): # Disassociation / deauthentication
+        return {"type": "deauth", "mac": _mac(data[10:16]), "target": _mac(data[4:10]),
+                "rssi": rssi if rssi is not None else 0, "channel": channel or 0, "timestamp": timestamp_ms, "t": ts}
+    return None
+
+def _record_time(record: Dict) -> float:
+    return record["t"]
+
+def parse_file(path: str, spool_dir: str) -> Tuple[str, str, int, int, Optional[float], Optional[float]]:
+    """
+    Process-pool worker: parses one capture into a spool file of pickled record chunks.
+    Returns (capture path, spool path, frames read, records kept, first and last record time).
+    """
+    frames = kept = 0
+    first_t = last_t = None
+    chunk: List[Dict] = []
+    fd, spool_path = tempfile.mkstemp(suffix=".spool", dir=spool_dir)
+    try:
+        with os.fdopen(fd, "wb") as spool:
+            for linktype, ts, data in iter_frames(path):
+                frames += 1
+                record = parse_frame(linktype, ts, data)
+                if record is None:
+                    continue
+                chunk.append(record)
+                kept += 1
+                first_t = ts if first_t is None else min(first_t, ts)
+                last_t = ts if last_t is None else max(last_t, ts)
+                if len(chunk) >= CHUNK_RECORDS:
+                    # Frames are written in capture order; sorting each chunk absorbs multi-interface jitter
+                    chunk.sort(key=_record_time)
+                    pickle.dump(chunk, spool, protocol=pickle.HIGHEST_PROTOCOL)
+                    chunk = []
+            if chunk:
+                chunk.sort(key=_record_time)
+                pickle.dump(chunk, spool, protocol=pickle.HIGHEST_PROTOCOL)
+    except Exception as e:
+        os.remove(spool_path)
+        raise ValueError(f"{path}: {e}") from None # Exceptions cross the process boundary; keep the file name
+    return path, spool_path, frames, kept, first_t, last_t
+
+def _iter_spool(spool_path: str) -> Iterator[Dict]:
+    with open(spool_path, "rb") as spool:
+        while True:
+            try:
+                yield from pickle.load(spool)
+            except EOFError:
+                return
+
+# --- Bulk load ---
+
+def _score(device: Dict, density: int):
+    device["anomaly_score"] = analyzer.calculate_anomaly_score(device, density)
+    device["persistence_score"] = analyzer.calculate_persistence_score(device)
+    device["pattern_score"] = analyzer.calculate_pattern_score(device)
+
+class BulkLoader:
+    """
+    Folds records (in capture-time order) into device aggregates and writes logs/devices on one connection.
+
+    A MAC the live sensor already knows may have timestamps newer than the captures, so its existing
+    timestamps are held aside during the load and merged back in time order at the end.
+    """
+
+    def __init__(self, db, existing: Set[Tuple[str, float]], density: int):
+        self.db = db
+        self.density = density # Distinct-MAC density, as live scoring uses (cardinality.device_density)
+        self.devices: Dict[str, Dict] = {}
+        self._packets: Dict[str, int] = {}
+        self._log_rows: List[tuple] = []
+        self._existing = existing # (mac, timestamp) of logs rows already in the DB for the imported range
+        self._live: Dict[str, List[int]] = {} # mac -> existing timestamps held aside during the load
+        self.records = 0
+        self.duplicates = 0
+
+    async def add(self, record: Dict):
+        mac = record["mac"]
+        if (mac, record["t"]) in self._existing:
+            self.duplicates += 1 # Imported before
+            return
+        device = self.devices.get(mac)
+        if device is None:
+            # Merge into what the live sensor already knows about this MAC
+            device = await exporter.load_device_state(self.db, mac)
+            if device is None:
+                device = analyzer.new_device(await analyzer.oui_lookup(mac))
+            else:
+                self._live[mac], device["timestamps"] = device["timestamps"], []
+            self.devices[mac] = device
+        analyzer.apply_packet(device, record)
+        seen = self._packets[mac] = self._packets.get(mac, 0) + 1
+        if seen % RESCORE_EVERY == 1 or record["type"] == "deauth":
+            _score(device, self.density)
+        self._log_rows.append(exporter.log_row(mac, record, device, record["t"]))
+        self.records += 1
+        if len(self._log_rows) >= LOG_BATCH_ROWS:
+            await self.flush_logs()
+
+    async def flush_logs(self):
+        if self._log_rows:
+            await exporter.bulk_log_packets(self.db, self._log_rows)
+            await self.db.commit()
+            self._log_rows = []
+
+    async def finish(self):
+        await self.flush_logs()
+        for mac, live_timestamps in self._live.items():
+            device = self.devices[mac]
+            if live_timestamps and live_timestamps[-1] < analyzer.WALL_CLOCK_MS_MIN:
+                live_timestamps = [] # Legacy uptime-based history, as in analyzer.apply_packet
+            device["timestamps"] = sorted(live_timestamps + device["timestamps"])[-analyzer.MAX_DATA_POINTS:]
+        banned_macs = await exporter.get_banned_macs()
+        for mac, device in self.devices.items():
+            _score(device, self.density)
+            if mac in banned_macs:
+                device["anomaly_score"] = max(device["anomaly_score"], 0.95)
+        await exporter.bulk_upsert_devices(self.db, self.devices)
+        await self.db.commit()
+
+async def import_captures(paths: List[str], jobs: int) -> Dict:
+    await init_db()
+    await cardinality.load_history() # Persisted distinct-MAC sketches, for the same density live scoring uses
+    started = time.time()
+    totals = {"files": 0, "frames": 0, "records": 0, "failed": []}
+    paths = list({os.path.realpath(path): path for path in paths}.values()) # Same file given twice
+    spool_dir = tempfile.mkdtemp(prefix="sigvoid-import-")
+    async with await get_db_connection() as db:
+        spool_paths: List[str] = []
+        try:
+            first_t = last_t = None
+            with ProcessPoolExecutor(max_workers=jobs) as pool:
+                futures = [asyncio.wrap_future(pool.submit(parse_file, path, spool_dir)) for path in paths]
+                for future in asyncio.as_completed(futures):
+                    try:
+                        path, spool_path, frames, kept, file_first, file_last = await future
+                    except Exception as e:
+                        print(f"Capture parse failed: {e}")
+                        totals["failed"].append(str(e))
+                        continue
+                    spool_paths.append(spool_path)
+                    totals["files"] += 1
+                    totals["frames"] += frames
+                    if file_first is not None:
+                        first_t = file_first if first_t is None else min(first_t, file_first)
+                        last_t = file_last if last_t is None else max(last_t, file_last)
+                    print(f"{path}: {frames} frames, {kept} probe/deauth records")
+
+            # Logs rows already covering the captured time range: a re-imported frame has the same (mac, time)
+            existing = set()
+            if first_t is not None:
+                cursor = await db.execute("SELECT mac, timestamp FROM logs WHERE timestamp BETWEEN ? AND ?",
+                                          (first_t, last_t))
+                existing = {(row["mac"], row["timestamp"]) for row in await cursor.fetchall()}
+
+            # Bulk-load mode: the live backend is stopped, so trade durability for speed and
+            # rebuild the logs index once instead of updating it per row
+            await db.execute("PRAGMA synchronous = OFF")
+            await db.execute("PRAGMA cache_size = -200000") # ~200 MB page cache
+            await db.execute("DROP INDEX IF EXISTS idx_logs_mac_timestamp")
+            loader = BulkLoader(db, existing, cardinality.device_density())
+            # k-way merge of the per-file spools; only one chunk per file is in memory at a time
+            for record in heapq.merge(*(_iter_spool(p) for p in spool_paths), key=_record_time):
+                await loader.add(record)
+            await loader.finish()
+        finally:
+            for spool_path in spool_paths:
+                try:
+                    os.remove(spool_path)
+                except OSError:
+                    pass
+            await db.execute("CREATE INDEX IF NOT EXISTS idx_logs_mac_timestamp ON logs (mac, timestamp);")
+            await db.commit()
+            try:
+                os.rmdir(spool_dir)
+            except OSError:
+                pass
+    # The warm-start snapshot would otherwise restore pre-import state over these rows on next boot
+    totals["snapshot_dropped"] = await snapshot.forget_devices(loader.devices)
+    totals["records"] = loader.records
+    totals["duplicates"] = loader.duplicates
+    totals["devices"] = len(loader.devices)
+    totals["seconds"] = round(time.time() - started, 1)
+    return totals
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(prog="python -m backend.pcap_import",
+                                     description="Import 802.11 pcap/pcapng captures into the SigVoid database.")
+    parser.add_argument("captures", nargs="+", help="pcap or pcapng files (radiotap or raw 802.11)")
+    parser.add_argument("-j", "--jobs", type=int, default=os.cpu_count() or 1, help="parser processes (default: CPU count)")
+    args = parser.parse_args(argv)
+    missing = [path for path in args.captures if not os.path.isfile(path)]
+    if missing:
+        parser.error(f"not found: {', '.join(missing)}")
+    totals = asyncio.run(import_captures(args.captures, max(1, args.jobs)))
+    print(f"Imported {totals['records']} records from {totals['files']} file(s) into {totals['devices']} devices "
+          f"in {totals['seconds']}s ({totals['frames']} frames read, {totals['duplicates']} already imported).")
+    if totals["failed"]:
+        print(f"{len(totals['failed'])} file(s) failed to parse.")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
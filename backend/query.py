@@ -0,0 +1,125 @@
+# backend/query.py
+import asyncio
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Sequence
+
+from backend import config
+from backend.database.database import DATABASE_PATH
+
+# Read side of the database. Dashboards, exports, timelines, heatmaps and cleanup scans run here
+# on read-only connections in their own thread pool. With the DB in WAL mode a reader sees a
+# consistent snapshot and never blocks (or is blocked by) the ingest writers.
+QUERY_WORKERS = config.get_int("QUERY_WORKERS", 4)
+QUERY_TIMEOUT_SECONDS = config.get_float("QUERY_TIMEOUT_SECONDS", 10.0)
+CACHE_ENTRIES = 128
+CACHE_MAX_ROWS = config.get_int("QUERY_CACHE_MAX_ROWS", 50000) # Budget across cached results (len() of each)
+# Under steady ingest, devices/logs change on every packet, so an exact-version cache would never
+# hit. A result is also reused while it is younger than this, bounding how stale reads can be.
+CACHE_MAX_STALENESS = config.get_float("QUERY_CACHE_MAX_STALENESS", 2.0)
+
+
+class QueryTimeout(Exception):
+    pass
+
+
+_executor = ThreadPoolExecutor(max_workers=QUERY_WORKERS, thread_name_prefix="sigvoid-query")
+_local = threading.local() # One read-only connection per pool thread, reused across queries
+_versions: Dict[str, int] = {} # table -> write counter, bumped by the writers in this process
+_cache: "OrderedDict[tuple, tuple]" = OrderedDict() # key -> (tables, versions, stored_at, result, rows), LRU order
+_cached_rows = 0
+_stats = {"queries": 0, "timeouts": 0, "cache_hits": 0, "cache_misses": 0}
+
+def _connection() -> sqlite3.Connection:
+    conn = getattr(_local, "conn", None)
+    if conn is None:
+        conn = sqlite3.connect(f"file:{os.path.abspath(DATABASE_PATH)}?mode=ro", uri=True,
+                               timeout=QUERY_TIMEOUT_SECONDS, check_same_thread=False)
+        conn.row_factory = sqlite3.Row
+        _local.conn = conn
+    return conn
+
+def _blocking_query(sql: str, params: tuple, deadline: float) -> List[Dict]:
+    conn = _connection()
+    # SQLite calls this every N VM steps; a non-zero return aborts the statement
+    conn.set_progress_handler(lambda: 1 if time.monotonic() > deadline else 0, 10000)
+    try:
+        rows = conn.execute(sql, params).fetchall()
+    except sqlite3.OperationalError as e:
+        if "interrupted" in str(e):
+            _stats["timeouts"] += 1
+            raise QueryTimeout("Query exceeded its time limit") from None
+        raise
+    finally:
+        conn.set_progress_handler(None, 0)
+    return [{k: row[k] for k in row.keys()} for row in rows]
+
+async def fetch_all(sql: str, params: Sequence = (), timeout: float = QUERY_TIMEOUT_SECONDS) -> List[Dict]:
+    """Runs a read on the query pool. Raises QueryTimeout once `timeout` seconds have passed."""
+    _stats["queries"] += 1
+    deadline = time.monotonic() + timeout
+    return await asyncio.get_event_loop().run_in_executor(_executor, _blocking_query, sql, tuple(params), deadline)
+
+async def fetch_one(sql: str, params: Sequence = (), timeout: float = QUERY_TIMEOUT_SECONDS) -> Optional[Dict]:
+    rows = await fetch_all(sql, params, timeout)
+    return rows[0] if rows else None
+
+async def run(func: Callable, *args) -> Any:
+    """Runs other blocking read-side work (decoding, filtering) on the query pool."""
+    return await asyncio.get_event_loop().run_in_executor(_executor, func, *args)
+
+def bump(*tables: str):
+    """Called by writers after committing, so cached reads over those tables are recomputed."""
+    for table in tables:
+        _versions[table] = _versions.get(table, 0) + 1
+
+def _current_versions(tables: Sequence[str]) -> tuple:
+    return tuple(_versions.get(table, 0) for table in tables)
+
+def _usable(entry: tuple, now: float) -> bool:
+    tables, versions, stored_at = entry[:3]
+    return versions == _current_versions(tables) or now - stored_at < CACHE_MAX_STALENESS
+
+def _evict(key: tuple):
+    global _cached_rows
+    _cached_rows -= _cache.pop(key)[4]
+
+async def cached(key: tuple, tables: Sequence[str], loader: Callable[[], Awaitable[Any]]) -> Any:
+    """
+    Result cache keyed on the caller's parameters and the write versions of `tables`.
+    Callers must treat the returned object as read-only; it is shared with later hits.
+    """
+    global _cached_rows
+    now = time.monotonic()
+    # Under ingest, versions move on every packet: entries that can never hit again are dropped right away
+    for stale_key in [k for k, entry in _cache.items() if not _usable(entry, now)]:
+        _evict(stale_key)
+
+    versions = _current_versions(tables) # Taken before loading: a write mid-load invalidates
+    entry = _cache.get(key)
+    if entry is not None:
+        _cache.move_to_end(key)
+        _stats["cache_hits"] += 1
+        return entry[3]
+    _stats["cache_misses"] += 1
+    result = await loader()
+    rows = len(result) if hasattr(result, "__len__") else 1
+    if rows > CACHE_MAX_ROWS:
+        return result # Too big to keep around
+    if key in _cache: # Another caller loaded it meanwhile
+        _evict(key)
+    _cache[key] = (tuple(tables), versions, time.monotonic(), result, rows)
+    _cached_rows += rows
+    while len(_cache) > CACHE_ENTRIES or _cached_rows > CACHE_MAX_ROWS:
+        _evict(next(iter(_cache)))
+    return result
+
+def get_stats() -> Dict:
+    return {**_stats, "cached_results": len(_cache), "cached_rows": _cached_rows, "workers": QUERY_WORKERS, "timeout_seconds": QUERY_TIMEOUT_SECONDS}
+
+def close():
+    _executor.shutdown(wait=False)
@@ -4,10 +4,12 @@ import json
 import asyncio
 import time # Import the time module
 from typing import Dict, Generator
+from backend import config
 
 # Global serial port instance
 _ser = None
-_port_config = {"port": "/dev/ttyUSB0", "baud": 115200}
+# Resolved at import time from the environment / sigvoid.conf so the uvicorn process picks it up
+_port_config = {"port": config.get("ESP_PORT", "/dev/ttyUSB0"), "baud": config.get_int("ESP_BAUD", 115200)}
 
 def set_serial_config(port: str, baud: int):
     """Sets the global serial port configuration. Closes existing port if open."""
@@ -56,7 +58,10 @@ def _blocking_read_serial_generator() -> Generator[Dict, None, None]:
             line = ser_instance.readline().decode("utf-8").strip()
             if line:
                 try:
-                    yield json.loads(line)
+                    record = json.loads(line)
+                    if isinstance(record, dict):
+                        record["t"] = time.time() # Receive time; the ESP's "timestamp" is ms since its boot
+                    yield record
                 except json.JSONDecodeError as e:
                     # Log malformed JSON but keep reading
                     print(f"JSON decode error: {e} from line: {line}")
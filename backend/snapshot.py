@@ -0,0 +1,163 @@
+# backend/snapshot.py
+import asyncio
+import gc
+import mmap
+import os
+import pickle
+import time
+from collections import deque
+from typing import Dict
+
+from backend import config
+from backend import state
+from backend import alerts
+from backend import analyzer
+from backend import cleanup
+from backend import query
+
+SNAPSHOT_PATH = config.get("SNAPSHOT_PATH", "backend/database/state.snap")
+SNAPSHOT_INTERVAL_SECONDS = config.get_int("SNAPSHOT_INTERVAL", 60)
+STALE_SCAN_TIMEOUT_SECONDS = 60 # Boot-time logs read for snapshots without a log id (older format)
+
+# File layout: 8-byte magic/version header followed by a single pickle payload
+_SNAPSHOT_MAGIC = b"SVSNAP01"
+
+def _copy_device(device: Dict) -> Dict:
+    # Sets/dicts/deques are updated in place by the analyzer, so they are copied. rssi_list and
+    # timestamps are the big ones, but apply_packet replaces them instead of appending, so sharing is safe.
+    return {key: value.copy() if isinstance(value, (set, dict, deque)) else value for key, value in device.items()}
+
+def _collect_state(log_id: int) -> Dict:
+    """
+    Copies the hot in-memory state into one dict. Called on the event loop thread so the ingest
+    path can't mutate anything mid-copy; the copy is pickled and written in an executor.
+    """
+    # Lots of small allocations over a big heap: without this, full GC passes take most of the copy time
+    gc_was_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        devices = {mac: _copy_device(device) for mac, device in state.devices.items()}
+    finally:
+        if gc_was_enabled:
+            gc.enable()
+    return {
+        "saved_at": time.time(),
+        "log_id": log_id, # Newest logs row this state already includes
+        "devices": devices,
+        "alert_cooldown": dict(alerts._alert_cooldown),
+        "vendor_cache": dict(analyzer._vendor_cache),
+    }
+
+def _blocking_write_snapshot(path: str, payload: bytes):
+    """Writes the snapshot to a temp file and atomically swaps it into place."""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(_SNAPSHOT_MAGIC)
+        f.write(payload)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path) # Readers never see a half-written snapshot
+
+def _blocking_save_snapshot(path: str, snap: Dict):
+    _blocking_write_snapshot(path, pickle.dumps(snap, protocol=pickle.HIGHEST_PROTOCOL))
+
+def _blocking_read_snapshot(path: str) -> Dict:
+    """Memory-maps the snapshot and unpickles straight from the mapping."""
+    with open(path, "rb") as f:
+        if os.fstat(f.fileno()).st_size <= len(_SNAPSHOT_MAGIC):
+            return None
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            if mm[:len(_SNAPSHOT_MAGIC)] != _SNAPSHOT_MAGIC:
+                print(f"Ignoring snapshot {path}: unknown format")
+                return None
+            view = memoryview(mm)
+            try:
+                return pickle.loads(view[len(_SNAPSHOT_MAGIC):])
+            finally:
+                view.release() # Must be released before the mmap can close
+
+async def save_snapshot(path: str = SNAPSHOT_PATH) -> bool:
+    try:
+        # Read before copying: any row logged after this id may be newer than the copy
+        row = await query.fetch_one("SELECT MAX(id) AS max_id FROM logs")
+        snap = _collect_state(row["max_id"] or 0)
+        await asyncio.get_event_loop().run_in_executor(None, _blocking_save_snapshot, path, snap)
+        return True
+    except Exception as e:
+        print(f"Error writing state snapshot: {e}")
+        return False
+
+async def load_snapshot(path: str = SNAPSHOT_PATH) -> bool:
+    """Restores hot state from the last snapshot. Missing or corrupt snapshots mean a cold start."""
+    if not os.path.exists(path):
+        return False
+    try:
+        snap = await asyncio.get_event_loop().run_in_executor(None, _blocking_read_snapshot, path)
+    except Exception as e:
+        print(f"Error reading state snapshot, starting cold: {e}")
+        return False
+    if not snap:
+        return False
+
+    devices = snap.get("devices", {})
+    # The DB keeps being written after the last snapshot (crash, kill, offline import). A MAC with logs
+    # newer than the snapshot has a newer devices row, so restoring it would later upsert stale state
+    # over that row: leave those to be loaded from the DB.
+    try:
+        if snap.get("log_id") is not None:
+            rows = await query.fetch_all("SELECT DISTINCT mac FROM logs WHERE id > ?", (snap["log_id"],))
+        else:
+            rows = await query.fetch_all("SELECT DISTINCT mac FROM logs WHERE timestamp > ?",
+                                         (snap.get("saved_at", 0),), timeout=STALE_SCAN_TIMEOUT_SECONDS)
+        newer = {row["mac"] for row in rows}
+    except Exception as e:
+        print(f"Error checking snapshot against the DB, not restoring devices: {e}")
+        newer = set(devices)
+    restored = {mac: device for mac, device in devices.items() if mac not in newer}
+    state.devices.update(restored)
+    analyzer._vendor_cache.update(snap.get("vendor_cache", {}))
+
+    # Drop cooldowns that already expired while we were down
+    now = time.time()
+    for mac, last_alert in snap.get("alert_cooldown", {}).items():
+        if now - last_alert < alerts.ALERT_COOLDOWN_SECONDS:
+            alerts._alert_cooldown[mac] = last_alert
+
+    print(f"Restored snapshot from {time.ctime(snap.get('saved_at', 0))}: {len(restored)} devices "
+          f"({len(devices) - len(restored)} newer in the DB), {len(analyzer._vendor_cache)} vendors cached.")
+    return True
+
+def _blocking_forget_devices(path: str, macs) -> int:
+    snap = _blocking_read_snapshot(path)
+    if not snap:
+        return 0
+    devices = snap.get("devices", {})
+    stale = [mac for mac in macs if mac in devices]
+    if stale:
+        for mac in stale:
+            del devices[mac]
+        _blocking_write_snapshot(path, pickle.dumps(snap, protocol=pickle.HIGHEST_PROTOCOL))
+    return len(stale)
+
+async def forget_devices(macs, path: str = SNAPSHOT_PATH) -> int:
+    """
+    Drops devices from the snapshot on disk after the DB rows were rewritten offline (pcap import),
+    so the next boot loads them from the DB instead of restoring stale cached state. Returns the count.
+    """
+    if not os.path.exists(path):
+        return 0
+    try:
+        return await asyncio.get_event_loop().run_in_executor(None, _blocking_forget_devices, path, list(macs))
+    except Exception as e:
+        # A snapshot we can't update must not win over the import: fall back to a cold start
+        print(f"Error updating state snapshot, removing it: {e}")
+        os.remove(path)
+        return 0
+
+async def snapshot_loop(interval: int = SNAPSHOT_INTERVAL_SECONDS):
+    """Background task writing a snapshot every `interval` seconds."""
+    while True:
+        await asyncio.sleep(interval)
+        await cleanup.evict_idle_devices() # Snapshot only what is still live
+        await save_snapshot()
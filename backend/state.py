@@ -0,0 +1,7 @@
+# backend/state.py
+from typing import Dict
+
+# Hot per-device aggregates used by the ingest path, keyed by MAC.
+# The devices table stays the durable copy; this cache is restored from
+# the warm-start snapshot on boot so the first packets skip cold DB reads.
+devices: Dict[str, Dict] = {}
@@ -0,0 +1,268 @@
+# backend/subscriptions.py
+import bisect
+import re
+import time
+from typing import Dict, List, Optional, Tuple
+
+# Columns a dashboard view can sort by. Every key keeps its own sorted list in the index.
+SORT_KEYS = ("anomaly_score", "persistence_score", "pattern_score", "deauth_count", "last_seen", "mac")
+DEFAULT_WINDOW = 50
+MAX_WINDOW = 500
+PUSH_INTERVAL_SECONDS = 0.25 # Per-client push rate cap; bursts of updates coalesce into one message
+DISTINCT_PUSH_SECONDS = 5.0 # Distinct MAC/SSID counts go out as their own message on this schedule
+TOP_SSIDS = 15
+RECENT_REFRESH_SECONDS = 10.0 # How often "recent" views re-check rows aging out without an update
+FILTER_IDLE_SECONDS = 30.0 # Filtered lists nobody has queried for this long stop being maintained
+
+def summarize_device(mac: str, device: Dict) -> Dict:
+    """
+    The per-row payload a dashboard window needs. Deliberately excludes rssi_list/timestamps;
+    history is served by /devices/{mac}/timeline.
+    """
+    rssi_list = device.get("rssi_list") or []
+    return {
+        "mac": mac,
+        "vendor": device.get("vendor") or "Unknown",
+        "ssid_list": sorted(device.get("ssid_list") or []),
+        "last_rssi": rssi_list[-1] if rssi_list else None,
+        "anomaly_score": round(device.get("anomaly_score") or 0.0, 4),
+        "persistence_score": round(device.get("persistence_score") or 0.0, 4),
+        "pattern_score": round(device.get("pattern_score") or 0.0, 4),
+        "deauth_count": device.get("deauth_count") or 0,
+        "channel_counts": dict(device.get("channel_counts") or {}),
+        "last_seen": device.get("last_seen") or 0.0,
+    }
+
+def _is_high_risk(row: Dict) -> bool:
+    return row["anomaly_score"] > 0.8 or row["deauth_count"] > 5
+
+def _discard(entries: List[Tuple], entry: Tuple):
+    i = bisect.bisect_left(entries, entry)
+    if i < len(entries) and entries[i] == entry:
+        del entries[i]
+
+
+class _FilteredList:
+    """
+    Rows matching one filter, sorted on one key. Shared by every client with the same filter and
+    kept up to date by DeviceIndex.update/remove, so a filtered window is a slice like an unfiltered one.
+    """
+
+    def __init__(self, view: "View", rows: Dict[str, Dict]):
+        self.view = view
+        self.rebuild(rows)
+
+    def rebuild(self, rows: Dict[str, Dict]):
+        self.entries = sorted((row[self.view.sort], mac) for mac, row in rows.items() if self.view.matches(row))
+        self.built_at = self.used_at = time.time()
+
+    def apply(self, old: Optional[Dict], row: Optional[Dict]):
+        if old is not None:
+            _discard(self.entries, (old[self.view.sort], old["mac"]))
+        if row is not None and self.view.matches(row):
+            bisect.insort(self.entries, (row[self.view.sort], row["mac"]))
+
+
+class DeviceIndex:
+    """
+    Sorted index over live device summaries. Updates cost O(log n) search plus a list insert
+    per sort key; reading an unfiltered window is a slice, independent of device count.
+    Site-wide aggregates (channel totals, SSID popularity, high-risk count) are maintained
+    incrementally so clients never need the full device map to draw them. Filtered views get
+    their own incrementally maintained lists (see _FilteredList).
+    """
+
+    def __init__(self):
+        self.rows: Dict[str, Dict] = {}
+        self._sorted: Dict[str, List[Tuple]] = {key: [] for key in SORT_KEYS}
+        self.version = 0
+        self.high_risk = 0
+        self.channel_totals: Dict[str, int] = {}
+        self.ssid_devices: Dict[str, int] = {}
+        self._filtered: Dict[tuple, _FilteredList] = {} # View.filter_key -> matching rows
+        self._aggregates: Tuple[int, Optional[Dict]] = (-1, None) # (version, aggregates) shared by all clients
+
+    def _account(self, row: Dict, sign: int):
+        for key in SORT_KEYS:
+            entry = (row[key], row["mac"])
+            entries = self._sorted[key]
+            if sign > 0:
+                bisect.insort(entries, entry)
+            else:
+                del entries[bisect.bisect_left(entries, entry)]
+        if _is_high_risk(row):
+            self.high_risk += sign
+        for channel, count in row["channel_counts"].items():
+            total = self.channel_totals.get(channel, 0) + sign * count
+            if total:
+                self.channel_totals[channel] = total
+            else:
+                self.channel_totals.pop(channel, None)
+        for ssid in row["ssid_list"]:
+            total = self.ssid_devices.get(ssid, 0) + sign
+            if total:
+                self.ssid_devices[ssid] = total
+            else:
+                self.ssid_devices.pop(ssid, None)
+
+    def update(self, mac: str, device: Dict):
+        row = summarize_device(mac, device)
+        old = self.rows.get(mac)
+        if old == row:
+            return
+        if old is not None:
+            self._account(old, -1)
+        self._account(row, 1)
+        for filtered in self._filtered.values():
+            filtered.apply(old, row)
+        self.rows[mac] = row
+        self.version += 1
+
+    def remove(self, mac: str):
+        old = self.rows.pop(mac, None)
+        if old is not None:
+            self._account(old, -1)
+            for filtered in self._filtered.values():
+                filtered.apply(old, None)
+            self.version += 1
+
+    def _filtered_entries(self, view: "View") -> List[Tuple]:
+        now = time.time()
+        for key in [k for k, f in self._filtered.items() if now - f.used_at > FILTER_IDLE_SECONDS]:
+            del self._filtered[key]
+        filtered = self._filtered.get(view.filter_key)
+        if filtered is None:
+            filtered = self._filtered[view.filter_key] = _FilteredList(view, self.rows)
+        elif view.preset == "recent" and now - filtered.built_at >= RECENT_REFRESH_SECONDS:
+            filtered.rebuild(self.rows) # Rows age out of "recent" without being updated
+        filtered.used_at = now
+        return filtered.entries
+
+    def query(self, view: "View") -> Tuple[List[Dict], int]:
+        """Rows in the view's window and the number of devices matching its filter."""
+        entries = self._filtered_entries(view) if view.has_filter else self._sorted[view.sort]
+        n = len(entries)
+        if view.descending:
+            hi = max(n - view.offset, 0)
+            picked = reversed(entries[max(hi - view.limit, 0):hi])
+        else:
+            picked = entries[view.offset:view.offset + view.limit]
+        return [self.rows[mac] for _, mac in picked], n
+
+    def aggregates(self) -> Dict:
+        """Computed once per index version; callers must not mutate the result."""
+        version, aggregates = self._aggregates
+        if version != self.version:
+            top_ssids = sorted(self.ssid_devices.items(), key=lambda item: item[1], reverse=True)[:TOP_SSIDS]
+            aggregates = {
+                "total": len(self.rows),
+                "high_risk": self.high_risk,
+                "channels": dict(self.channel_totals),
+                "top_ssids": dict(top_ssids),
+            }
+            self._aggregates = (self.version, aggregates)
+        return aggregates
+
+
+class View:
+    """What one client is looking at: sort, filter and an offset/limit window."""
+
+    def __init__(self, sort: str = "anomaly_score", order: str = "desc", offset: int = 0, limit: int = DEFAULT_WINDOW,
+                 mac_filter: str = "", ssid_filter: str = "", min_score: float = 0.0, preset: str = "all"):
+        if sort not in SORT_KEYS:
+            raise ValueError(f"Unknown sort key: {sort}")
+        if preset not in ("all", "recent", "high_risk"):
+            raise ValueError(f"Unknown preset: {preset}")
+        try:
+            self.mac_regex = re.compile(mac_filter, re.IGNORECASE) if mac_filter else None
+            self.ssid_regex = re.compile(ssid_filter, re.IGNORECASE) if ssid_filter else None
+        except re.error as e:
+            raise ValueError(f"Invalid filter regex: {e}")
+        self.sort = sort
+        self.descending = order != "asc"
+        self.offset = max(0, int(offset))
+        self.limit = max(1, min(int(limit), MAX_WINDOW))
+        self.min_score = float(min_score or 0.0)
+        self.preset = preset
+
+    @property
+    def has_filter(self) -> bool:
+        return bool(self.mac_regex or self.ssid_regex or self.min_score > 0 or self.preset != "all")
+
+    @property
+    def filter_key(self) -> tuple:
+        """Views with equal keys share one filtered list in the index."""
+        return (self.sort, self.mac_regex and self.mac_regex.pattern, self.ssid_regex and self.ssid_regex.pattern,
+                self.min_score, self.preset)
+
+    def matches(self, row: Dict) -> bool:
+        # Same semantics as exporter.get_filtered_devices
+        if row["anomaly_score"] < self.min_score:
+            return False
+        if self.mac_regex and not self.mac_regex.search(row["mac"]):
+            return False
+        if self.ssid_regex and not any(self.ssid_regex.search(ssid) for ssid in row["ssid_list"]):
+            return False
+        if self.preset == "recent" and row["last_seen"] < time.time() - 3600:
+            return False
+        if self.preset == "high_risk" and not _is_high_risk(row):
+            return False
+        return True
+
+
+class Subscription:
+    """
+    Per-client window state. Remembers what was last sent so each push carries only
+    rows that entered or changed, the new order, and the aggregate counts.
+    """
+
+    def __init__(self):
+        self.view = View()
+        self._sent_rows: Dict[str, Dict] = {}
+        self._sent_order: List[str] = []
+        self._sent_counts: Optional[Dict] = None
+        self._seen_version = -1
+        self._computed_at = 0.0
+
+    def set_view(self, message: Dict) -> Optional[str]:
+        """Applies a client's subscribe message. Returns an error string if it was rejected."""
+        try:
+            self.view = View(
+                sort=message.get("sort", "anomaly_score"),
+                order=message.get("order", "desc"),
+                offset=message.get("offset", 0),
+                limit=message.get("limit", DEFAULT_WINDOW),
+                mac_filter=message.get("mac_filter", ""),
+                ssid_filter=message.get("ssid_filter", ""),
+                min_score=message.get("min_score", 0.0),
+                preset=message.get("preset", "all"),
+            )
+        except (TypeError, ValueError) as e:
+            return str(e)
+        self._seen_version = -1 # Force a recompute on the next push
+        return None
+
+    def next_update(self, index: DeviceIndex) -> Optional[Dict]:
+        """Builds the next window message, or None when nothing this client can see has changed."""
+        now = time.time()
+        if index.version == self._seen_version and (self.view.preset != "recent" or
+                                                    now - self._computed_at < RECENT_REFRESH_SECONDS):
+            return None
+        self._seen_version = index.version
+        self._computed_at = now
+
+        rows, matching = index.query(self.view)
+        order = [row["mac"] for row in rows]
+        changed = [row for row in rows if self._sent_rows.get(row["mac"]) != row]
+        counts = {**index.aggregates(), "matching": matching}
+        if order == self._sent_order and not changed and counts == self._sent_counts:
+            return None
+
+        self._sent_rows = {row["mac"]: row for row in rows}
+        self._sent_order = order
+        self._sent_counts = counts
+        return {"type": "window", "offset": self.view.offset, "order": order, "rows": changed, "counts": counts}
+
+
+# Shared by the ingest task (writer) and every websocket client (readers)
+device_index = DeviceIndex()
@@ -179,69 +179,120 @@ document.addEventListener('DOMContentLoaded', () => {
 });
 
 
-const socket = io();
+// Windowed device subscription over the backend's /ws endpoint.
+// We declare a view (sort, filters, offset/limit) and the server only sends rows that
+// entered or changed inside that window, plus site-wide counts for the aggregate charts.
+const deviceWindow = {
+    rows: {},   // mac -> latest row received for the current window
+    order: [],  // macs in window order
+    view: { sort: 'anomaly_score', order: 'desc', offset: 0, limit: 50, mac_filter: '', ssid_filter: '', min_score: 0, preset: 'all' }
+};
+const SIGNAL_CHART_DEVICES = 5; // Timelines fetched for the top rows of the window
+let deviceSocket;
+let signalChartMacs = '';
+
+function connectDeviceSocket() {
+    const protocol = location.protocol === 'https:' ? 'wss' : 'ws';
+    deviceSocket = new WebSocket(`${protocol}://${location.host}/ws`);
+    deviceSocket.onopen = () => subscribe({});
+    deviceSocket.onmessage = (event) => {
+        const message = JSON.parse(event.data);
+        if (message.type === 'window') {
+            handleWindowUpdate(message);
+        } else if (message.type === 'diagnostics') {
+            updateDiagnostics(message.diagnostics);
+        } else if (message.type === 'distinct') {
+            Alpine.store('distinct', message.distinct); // HyperLogLog estimates keyed by window seconds
+        } else if (message.type === 'error') {
+            showToast(message.message, 'error');
+        }
+    };
+    deviceSocket.onclose = () => setTimeout(connectDeviceSocket, 2000); // Reconnect; onopen re-sends our view
+}
 
-socket.on('update', ({ devices, diagnostics }) => {
-    // Update Alpine store (which is the source of truth for the UI)
-    Alpine.store('devices', devices);
-    Alpine.store('diagnostics', diagnostics);
+// Changing the view (filters, sort, scrolling to another page) is just a new subscribe message
+function subscribe(changes) {
+    Object.assign(deviceWindow.view, changes);
+    Alpine.store('deviceView', { ...deviceWindow.view });
+    if (deviceSocket && deviceSocket.readyState === WebSocket.OPEN) {
+        deviceSocket.send(JSON.stringify({ type: 'subscribe', ...deviceWindow.view }));
+    }
+}
+window.subscribe = subscribe;
 
-    // Signal strength chart
-    signalChart.data.datasets = Object.entries(devices).map(([mac, data]) => ({
-        label: `${mac} (${data.vendor})`,
-        // Convert timestamps from milliseconds to milliseconds for Chart.js time scale
-        data: data.timestamps.map((t, i) => ({ x: t, y: data.rssi_list[i] })),
-        borderColor: getColor(mac),
-        fill: false,
-        tension: 0.3
-    }));
-    signalChart.update();
+function handleWindowUpdate({ order, rows, counts }) {
+    rows.forEach(row => { deviceWindow.rows[row.mac] = row; });
+    deviceWindow.order = order;
+    const devices = {};
+    order.forEach(mac => { devices[mac] = deviceWindow.rows[mac]; });
+    deviceWindow.rows = devices; // Forget rows that left the window
 
-    // SSID distribution chart
-    const ssidCounts = {};
-    Object.values(devices).forEach(device => {
-        device.ssid_list.forEach(ssid => {
-            ssidCounts[ssid] = (ssidCounts[ssid] || 0) + 1;
-        });
-    });
-    ssidChart.data.labels = Object.keys(ssidCounts);
+    Alpine.store('devices', devices);
+    Alpine.store('deviceCounts', counts);
+
+    // SSID distribution chart (site-wide, top SSIDs by number of devices probing them)
+    ssidChart.data.labels = Object.keys(counts.top_ssids);
     ssidChart.data.datasets = [{
-        data: Object.values(ssidCounts),
-        backgroundColor: Object.keys(ssidCounts).map(ssid => getColor(ssid, 0.7)),
-        borderColor: Object.keys(ssidCounts).map(ssid => getColor(ssid, 1))
+        data: Object.values(counts.top_ssids),
+        backgroundColor: Object.keys(counts.top_ssids).map(ssid => getColor(ssid, 0.7)),
+        borderColor: Object.keys(counts.top_ssids).map(ssid => getColor(ssid, 1))
     }];
     ssidChart.update();
 
-    // Persistence timeline
-    persistenceChart.data.labels = Object.keys(devices);
+    // Persistence timeline (rows in the current window)
+    persistenceChart.data.labels = order;
     persistenceChart.data.datasets = [{
         label: 'Persistence',
-        data: Object.values(devices).map(device => device.persistence_score),
-        backgroundColor: Object.values(devices).map(device => 
-            device.anomaly_score > 0.8 ? getColor('anomaly_high', 0.7) : getColor('normal', 0.7)
+        data: order.map(mac => devices[mac].persistence_score),
+        backgroundColor: order.map(mac =>
+            devices[mac].anomaly_score > 0.8 ? getColor('anomaly_high', 0.7) : getColor('normal', 0.7)
         ),
-        borderColor: Object.values(devices).map(device => 
-            device.anomaly_score > 0.8 ? getColor('anomaly_high', 1) : getColor('normal', 1)
+        borderColor: order.map(mac =>
+            devices[mac].anomaly_score > 0.8 ? getColor('anomaly_high', 1) : getColor('normal', 1)
         )
     }];
     persistenceChart.update();
 
-    // Channel activity
-    const channelCounts = {};
-    Object.values(devices).forEach(device => {
-        Object.entries(device.channel_counts).forEach(([channel, count]) => {
-            channelCounts[channel] = (channelCounts[channel] || 0) + count;
-        });
-    });
-    channelChart.data.labels = Object.keys(channelCounts).map(Number).sort((a, b) => a - b);
+    // Channel activity (site-wide totals maintained by the server)
+    const channels = Object.keys(counts.channels).map(Number).sort((a, b) => a - b);
+    channelChart.data.labels = channels;
     channelChart.data.datasets = [{
         label: 'Probes',
-        data: Object.values(channelCounts),
+        data: channels.map(channel => counts.channels[String(channel)]),
         backgroundColor: getColor('channel_probes', 0.7),
         borderColor: getColor('channel_probes', 1)
     }];
     channelChart.update();
 
+    const topMacs = order.slice(0, SIGNAL_CHART_DEVICES).join(',');
+    if (topMacs !== signalChartMacs) {
+        signalChartMacs = topMacs;
+        refreshSignalChart();
+    }
+}
+
+// Signal strength chart: server-downsampled RSSI timelines for the top rows of the window
+async function refreshSignalChart() {
+    const macs = signalChartMacs ? signalChartMacs.split(',') : [];
+    const timelines = await Promise.all(macs.map(mac =>
+        fetch(`/devices/${encodeURIComponent(mac)}/timeline?points=200`)
+            .then(response => response.ok ? response.json() : null)
+            .catch(() => null)
+    ));
+    signalChart.data.datasets = timelines.filter(Boolean).map(timeline => ({
+        label: `${timeline.mac} (${deviceWindow.rows[timeline.mac]?.vendor || 'Unknown'})`,
+        data: timeline.series.rssi.map(([t, rssi]) => ({ x: t * 1000, y: rssi })), // Epoch seconds to ms for Chart.js
+        borderColor: getColor(timeline.mac),
+        fill: false,
+        tension: 0.3
+    }));
+    signalChart.update();
+}
+setInterval(refreshSignalChart, 15000); // Unchanged ranges are cheap 304s thanks to the timeline ETag
+
+function updateDiagnostics(diagnostics) {
+    Alpine.store('diagnostics', diagnostics);
+
     // Gauges
     const maxHeap = 40000; // Assuming ~40KB max free heap for a typical ESP8266 sketch
     const currentHeap = diagnostics.free_heap || 0;
@@ -252,7 +303,10 @@ socket.on('update', ({ devices, diagnostics }) => {
     const currentUptime = diagnostics.uptime || 0; // In seconds
     uptimeGauge.data.datasets[0].data = [Math.min(currentUptime, maxUptimeForGauge), Math.max(0, maxUptimeForGauge - currentUptime)];
     uptimeGauge.update();
-});
+}
+
+// Connect after charts (DOMContentLoaded) and Alpine stores exist
+window.addEventListener('load', connectDeviceSocket);
 
 // Helper to format uptime for display (e.g., 1d 5h 30m)
 function formatUptime(seconds) {
@@ -375,13 +429,15 @@ window.updateEspConfig = updateEspConfig;
 document.addEventListener('alpine:init', () => {
     // Add isLoading to Alpine.store
     Alpine.store('isLoading', false);
+    Alpine.store('devices', {});
+    Alpine.store('deviceCounts', { total: 0, matching: 0, high_risk: 0, channels: {}, top_ssids: {} });
+    Alpine.store('deviceView', { ...deviceWindow.view });
+    Alpine.store('distinct', { mac: {}, ssid: {} });
+    Alpine.store('diagnostics', {});
 
     Alpine.data('dashboardData', () => ({
         // ... (your existing x-data properties will be merged by Alpine)
         init() {
-            Alpine.store('devices', this.devices);
-            Alpine.store('diagnostics', this.diagnostics);
-
             // Re-order widgets based on stored order
             this.$nextTick(() => {
                 const widgetsContainer = this.$refs.widgets;
@@ -13,6 +13,14 @@ const int ledPin = D4; // Onboard LED for alerts (usually GPIO2 on NodeMCU)
 uint8_t busyChannels[3] = {1, 6, 11}; // Dynamic channel selection
 int channelProbes[13] = {0}; // Track probe counts per channel
 
+// Backend-supplied hop plan (SET_CHANNEL_PLAN). Overrides busyChannels while fresh.
+#define MAX_PLAN_ENTRIES 13
+#define PLAN_TIMEOUT_MS 600000 // Fall back to local channel selection if the backend stops refreshing
+uint8_t planChannels[MAX_PLAN_ENTRIES];
+uint16_t planDwell[MAX_PLAN_ENTRIES];
+int planLen = 0;
+unsigned long planUpdatedAt = 0;
+
 // Use non-const char arrays so they can be modified
 char apSSID[33] = "SigVoid_Honeypot"; // Default SSID
 char apPassword[65] = "";            // Default Password (empty for open)
@@ -80,8 +88,10 @@ void promisc_cb(uint8_t *buf, uint16_t len) {
     digitalWrite(ledPin, LOW); // Blink LED (LOW is ON for NodeMCU onboard LED)
     delay(50);
     digitalWrite(ledPin, HIGH); // LED off
-    Serial.printf("{\"type\":\"deauth\",\"mac\":\"%02X:%02X:%02X:%02X:%02X:%02X\",\"timestamp\":%lu}\n",
-                  src_mac[0], src_mac[1], src_mac[2], src_mac[3], src_mac[4], src_mac[5], timestamp);
+    uint8_t* dst_mac = &buf[4]; // Receiver (deauth target) is addr1
+    Serial.printf("{\"type\":\"deauth\",\"mac\":\"%02X:%02X:%02X:%02X:%02X:%02X\",\"target\":\"%02X:%02X:%02X:%02X:%02X:%02X\",\"rssi\":%d,\"channel\":%d,\"timestamp\":%lu}\n",
+                  src_mac[0], src_mac[1], src_mac[2], src_mac[3], src_mac[4], src_mac[5],
+                  dst_mac[0], dst_mac[1], dst_mac[2], dst_mac[3], dst_mac[4], dst_mac[5], rssi, channel, timestamp);
   }
 }
 
@@ -96,14 +106,30 @@ void loop() {
   }
 
   static int channel_idx = 0;
-  // Make sure to only set channels from 1 to 13
-  uint8_t target_channel = busyChannels[channel_idx];
-  if (target_channel < 1 || target_channel > 13) {
-      target_channel = 1; // Fallback to channel 1 if invalid
+  static unsigned long dwell_started = 0;
+  static unsigned long dwell_ms = 0;
+  if (millis() - dwell_started >= dwell_ms) {
+    uint8_t target_channel;
+    if (planLen > 0 && millis() - planUpdatedAt < PLAN_TIMEOUT_MS) {
+      // Backend hop plan: per-channel dwell weighted by observed occupancy
+      channel_idx = channel_idx % planLen;
+      target_channel = planChannels[channel_idx];
+      dwell_ms = planDwell[channel_idx];
+      channel_idx = (channel_idx + 1) % planLen;
+    } else {
+      channel_idx = channel_idx % 3;
+      target_channel = busyChannels[channel_idx];
+      dwell_ms = 100;
+      channel_idx = (channel_idx + 1) % 3; // Cycle through top 3 busy channels
+    }
+    // Make sure to only set channels from 1 to 13
+    if (target_channel < 1 || target_channel > 13) {
+        target_channel = 1; // Fallback to channel 1 if invalid
+    }
+    wifi_set_channel(target_channel);
+    dwell_started = millis();
   }
-  wifi_set_channel(target_channel);
-  channel_idx = (channel_idx + 1) % 3; // Cycle through top 3 busy channels
-  delay(100);
+  delay(5); // Short sleep keeps serial commands responsive during long dwells
 
   // Periodic diagnostics
   static unsigned long last_diag = 0;
@@ -168,6 +194,8 @@ void handleSerialCommands() {
       } else {
         Serial.println("{\"type\":\"error\",\"message\":\"Password too long (max 64 chars)\"}");
       }
+    } else if (command.startsWith("SET_CHANNEL_PLAN:")) {
+      applyChannelPlan(command.substring(17)); // "SET_CHANNEL_PLAN:".length()
     } else {
       // Echo unrecognized command for debugging
       Serial.printf("{\"type\":\"info\",\"message\":\"Unrecognized command: %s\"}\n", command.c_str());
@@ -175,6 +203,39 @@ void handleSerialCommands() {
   }
 }
 
+// Parses "<ch>:<dwell_ms>,<ch>:<dwell_ms>,..." from the backend's channel planner
+void applyChannelPlan(String plan) {
+  uint8_t channels[MAX_PLAN_ENTRIES];
+  uint16_t dwell[MAX_PLAN_ENTRIES];
+  int count = 0;
+  int start = 0;
+  while (start < (int)plan.length() && count < MAX_PLAN_ENTRIES) {
+    int end = plan.indexOf(',', start);
+    if (end < 0) end = plan.length();
+    String entry = plan.substring(start, end);
+    int sep = entry.indexOf(':');
+    if (sep > 0) {
+      int ch = entry.substring(0, sep).toInt();
+      int ms = entry.substring(sep + 1).toInt();
+      if (ch >= 1 && ch <= 13 && ms >= 20 && ms <= 5000) {
+        channels[count] = ch;
+        dwell[count] = ms;
+        count++;
+      }
+    }
+    start = end + 1;
+  }
+  if (count == 0) {
+    Serial.println("{\"type\":\"error\",\"message\":\"Invalid channel plan\"}");
+    return;
+  }
+  memcpy(planChannels, channels, count);
+  memcpy(planDwell, dwell, count * sizeof(uint16_t));
+  planLen = count;
+  planUpdatedAt = millis();
+  Serial.printf("{\"type\":\"info\",\"message\":\"Channel plan set (%d channels)\"}\n", count);
+}
+
 void loadSettings() {
   char temp_ssid_char;
   EEPROM.get(SSID_ADDR, temp_ssid_char); // Read first char of SSID to check if EEPROM is initialized
@@ -288,9 +288,9 @@ fi
 log INFO "ESP8266 detected at $ESP_PORT"
 echo -e "${GREEN}[+] ESP8266 detected at $ESP_PORT.${NC}"
 
-# Set serial port in backend config
-# This needs to be done via Python to update the _port_config in serial_reader.py
-python3 -c "from backend.serial_reader import set_serial_config; set_serial_config('$ESP_PORT', $ESP_BAUD)"
+# Pass the serial config to the backend process; serial_reader.py reads these
+# (falling back to sigvoid.conf) at import time
+export ESP_PORT ESP_BAUD
 
 # Check audio alert
 log INFO "Checking audio alert"